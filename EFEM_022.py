@@ -2,28 +2,45 @@
 # -*- coding: utf-8 -*-
 
 import sys
+import re
 import socket
+import selectors
 import threading
 import time
-import queue
-from datetime import datetime
-import json # 用於美化字典輸出
+import functools
+from enum import IntEnum
+from collections import namedtuple, deque
 
 # 確保已安裝 PyQt5: pip install PyQt5
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
-                             QPushButton, QLabel, QLineEdit, QTextEdit, QGridLayout, QGroupBox,
+                             QPushButton, QLabel, QLineEdit, QTextEdit, QPlainTextEdit, QGridLayout, QGroupBox,
                              QMessageBox, QComboBox, QTabWidget, QSplitter, QFrame,
-                             QListWidget, QListWidgetItem)
-from PyQt5.QtCore import QThread, pyqtSignal, pyqtSlot, QObject, Qt, QRect, QPoint
-from PyQt5.QtGui import QTextCursor, QColor, QFont, QPalette
+                             QListWidget, QListWidgetItem, QStackedWidget, QCheckBox)
+from PyQt5.QtCore import QThread, pyqtSignal, pyqtSlot, QObject, Qt, QRect, QPoint, QTimer
+from PyQt5.QtGui import QTextCursor, QTextCharFormat, QColor, QFont, QPalette, QBrush
 
 # --- 常數 ---
 DEFAULT_IP = "192.168.1.1"
 DEFAULT_PORT = 6000
 BUFFER_SIZE = 4096
+SOCKET_RCVBUF = 65536 # 接收緩衝區大小 (位元組)
+KEEPALIVE_IDLE = 30     # 閒置多久後開始送 keepalive (秒)
+KEEPALIVE_INTERVAL = 10 # keepalive 重送間隔 (秒)
+KEEPALIVE_COUNT = 3     # 連續幾次無回應即判定斷線
 CONNECT_TIMEOUT = 5  # 連線超時 (秒)
 COMMAND_TIMEOUT = 25 # 指令回應超時 (秒)
 CONFIRMATION_TIMEOUT = 60 # 使用者確認超時 (秒)
+LOG_FLUSH_INTERVAL_MS = 50 # 日誌區域批次寫入間隔 (毫秒)
+LOG_MAX_LINES = 5000 # 日誌區域保留的最多行數，超過時自動捨棄最舊的行
+CLOSE_WAIT_TIMEOUT = 1.5 # 關閉視窗時等待各執行緒結束的上限 (秒)
+CLOSE_POLL_INTERVAL_MS = 50 # 關閉視窗時輪詢執行緒狀態的間隔 (毫秒)
+LOG_LEVEL = {"gray": 10, "darkgray": 10, "black": 20, "orange": 30, "red": 40} # 日誌顏色 -> 等級，未列出的顏色視為 20
+LOG_LEVEL_DEBUG = 10   # 勾選「顯示除錯訊息」時的最低等級
+LOG_LEVEL_DEFAULT = 20 # 預設最低等級 (gray/darkgray 除錯訊息不顯示)
+UI_FONT = ("Microsoft JhengHei UI", 9)   # 主視窗字型
+LIST_FONT = ("Microsoft JhengHei UI", 8) # 步驟列表字型 (稍小)
+LOG_FONT = ("Consolas", 9)               # 日誌區域字型 (等寬)
+SMART_GET_LP1_TEMPLATE = "SmartGet,Robot1,UpArm,Loadport1,{slot}" # 正常流程取片指令 (依 Slot 填入)
 
 # --- 錯誤代碼映射 (部分範例，需要從 API 手冊 1.4 完整填充) ---
 ERROR_CODES = {
@@ -46,6 +63,68 @@ ERROR_CODES = {
     # ... 在此處添加更多來自 API 手冊的錯誤代碼 ...
 }
 
+# --- 回應解析 ---
+# 回應格式: [#]指令,裝置,OK|Error,內容[$]，一次比對取出各欄位
+_RESP_RE = re.compile(r'^\s*#?([^,]+),([^,]+),(OK|Error),([^$]*)\$?\s*$')
+_ERR_RE = re.compile(r',Error,([^,$\s]+)') # 錯誤回應中的錯誤代碼
+_WAFER_CODES = b'12345' # Map 中代表有 Wafer 的狀態碼
+# CheckWaferPresence 成功回應: Robot 回兩欄 (LowArm, UpArm)，Aligner 只回一欄 (第二組為 None)
+_PRESENCE_RE = re.compile(r'^\s*#?CheckWaferPresence,([^,]+),OK,(Presence|Absence)(?:,(Presence|Absence))?\$?\s*$')
+
+def _pack_map(map_data):
+    """將逗號分隔的 Map 字串壓縮為每個 Slot 一個位元組的 bytes"""
+    codes = bytearray()
+    start = 0
+    while True:
+        end = map_data.find(',', start)
+        field = map_data[start:] if end < 0 else map_data[start:end]
+        # 非單一 ASCII 字元的欄位視為無效狀態 ('?')
+        codes.append(ord(field) if len(field) == 1 and field.isascii() else 0x3F)
+        if end < 0:
+            return bytes(codes)
+        start = end + 1
+
+def _parse_map(response):
+    """從 GetMapResult 回應解析 Map，回傳 (Map 字串, 每個 Slot 一個位元組的 bytes)"""
+    m = _RESP_RE.match(response)
+    if m and m.group(3) == "OK":
+        map_data = m.group(4)
+        return map_data, _pack_map(map_data)
+    return "解析錯誤", b""
+
+@functools.lru_cache(maxsize=256)
+def _error_desc(error_code):
+    """錯誤代碼的說明 (快取；未知代碼的預設字串只格式化一次)"""
+    return ERROR_CODES.get(error_code, f"未知錯誤碼 ({error_code})")
+
+def _format_error_reply(error_data):
+    """將錯誤回應 (cmd,device,Error,code) 轉成日誌文字"""
+    parts = error_data.strip().rstrip('$').split(',')
+    if len(parts) >= 4 and parts[-2] == "Error":
+        return f"指令錯誤: [{parts[1]}] {parts[0]} -> {_error_desc(parts[-1].strip())}"
+    return f"收到未解析錯誤回應: {error_data.strip()}"
+
+def _reply_key(text):
+    """取得指令或回應開頭的 (指令名, 設備)；EFEM 回應會原樣帶回這兩欄，可用來對應指令"""
+    return tuple(text.strip().lstrip('#').split(',', 2)[:2])
+
+_DEVICE_INDEX_DIGITS = "0123456789" # 設備名稱結尾的編號 (Loadport1 -> Loadport)
+# split 的 maxsplit：比處理函式讀取的最後一欄多切一次，讓 len(parts) 的判斷與完整切割一致
+_EVENT_MAX_SPLIT = 4   # 事件讀到 parts[3]，並以 len == 3 / 4 判斷格式
+_STATUS_MAX_SPLIT = 13 # GetStatus,EFEM 讀到 parts[12]
+# EFEM 事件中只需記錄日誌者: 事件名稱 -> (訊息, 顏色)
+_EFEM_EVENT_LOGS = {
+    "Run": ("EFEM 開始執行...", "darkblue"),
+    "Idle": ("EFEM 執行完畢/閒置", "darkblue"),
+    "Error": ("EFEM 報告錯誤狀態", "red"),
+}
+
+# GetStatus,EFEM 各欄位的顯示文字：'0' 對應第一個，其餘值對應第二個 (與協定文件一致)
+_EFEM_EMO_TEXT = ("觸發", "正常")
+_EFEM_FFU_TEXT = ("FFU PD:過高", "FFU PD:正常")
+_EFEM_MODE_TEXT = ("本地 (Local)", "遠端 (Remote)")
+_EFEM_DOOR_TEXT = ("開啟", "關閉")
+
 # --- 流程步驟描述 ---
 # (與 v1.12 版本相同，省略)
 NORMAL_FLOW_STEPS = {
@@ -56,7 +135,7 @@ NORMAL_FLOW_STEPS = {
     9: "UI -> EFEM: 開門命令 (Load)", 10: "EFEM -> UI: 回覆開門完成",
     11: "UI -> EFEM: Slot Mapping (GetMapResult)", 12: "EFEM -> UI: Slot Mapping完成",
     13: "UI -> 終端: 層數資料核對", 14: "終端 -> UI: 層數資料正確",
-    15: "UI -> EFEM: 取LOADPORT1第{slot}層 (SmartGet)", 16: "EFEM -> UI: 取完WAFER片",
+    15: "UI -> EFEM: 取LOADPORT1第%(slot)s層 (SmartGet)", 16: "EFEM -> UI: 取完WAFER片",
     17: "UI -> EFEM: 送片至ALIGNER (SmartPut)", 18: "EFEM -> UI: 放至ALIGNER完成",
     19: "UI -> EFEM: ALIGNER進行Align (Alignment)", 20: "EFEM -> UI: ALIGNER進行Align完成",
     21: "UI -> EFEM: 讀取OCR (ReadID)", 22: "EFEM -> UI: 讀取OCR並回傳給UI",
@@ -86,24 +165,106 @@ RECOVERY_FLOW_STEPS = {
     124: "恢復失敗，亮紅燈閃爍+警報", 199: "恢復流程完成",
     -101: "恢復流程錯誤中止", -102: "恢復流程使用者中止"
 }
-ALL_STEP_DESCRIPTIONS = {**NORMAL_FLOW_STEPS, **RECOVERY_FLOW_STEPS}
+ALL_STEP_DESCRIPTIONS = NORMAL_FLOW_STEPS | RECOVERY_FLOW_STEPS
 
-def get_step_description(step_num, **kwargs):
-    """獲取步驟描述，支持格式化"""
+# 動作步驟的下一步若為等待/回覆類型，需一併高亮 (import 時預先計算)
+_CMD_WAIT_STEPS = frozenset(n for n, d in ALL_STEP_DESCRIPTIONS.items() if "等待" in d or "回覆" in d)
+_CONFIRM_WAIT_STEPS = frozenset(n for n, d in ALL_STEP_DESCRIPTIONS.items() if "等待" in d or "正確" in d)
+
+@functools.lru_cache(maxsize=None)
+def _desc_plain(step_num):
+    """獲取不需格式化的步驟描述 (快取)"""
+    return ALL_STEP_DESCRIPTIONS.get(step_num, f"未知步驟 {step_num}")
+
+@functools.lru_cache(maxsize=512)
+def _desc_formatted(step_num, **kwargs):
+    """獲取參數化的步驟描述 (快取；參數只有 slot 等少數取值，25 個 Slot 各格式化一次)"""
     desc_template = ALL_STEP_DESCRIPTIONS.get(step_num, f"未知步驟 {step_num}")
     try:
-        return desc_template.format(**kwargs)
+        return desc_template % kwargs # 參數化描述使用 %(name)s 樣板
     except KeyError:
         return desc_template
 
+def get_step_description(step_num, **kwargs):
+    """獲取步驟描述，支持格式化"""
+    if not kwargs:
+        return _desc_plain(step_num)
+    return _desc_formatted(step_num, **kwargs)
+
+# 步驟列表顯示用的描述 (參數以 X 代替)，import 時建立一次，重建列表時直接查表
+_STEP_DESC_CACHE = {n: get_step_description(n, slot='X')
+                    for n in (*range(1, 39), *range(101, 125), 0, 99, -1, -2, 199, -101, -102)}
+
+class FlowStatus(IntEnum):
+    """流程起始/結束狀態碼 (數值與步驟描述表一致，可直接當 int 透過 signal 傳遞)"""
+    IDLE = 0
+    DONE = 99
+    ERROR = -1
+    USER_STOP = -2
+    RECOVERY_START = 101
+    RECOVERY_DONE = 199
+    RECOVERY_ERROR = -101
+    RECOVERY_STOP = -102
+
+    @property
+    def desc(self):
+        """狀態描述 (import 時預先建立)"""
+        return _FLOW_STATUS_DESC[self]
+
+_FLOW_STATUS_DESC = {status: get_step_description(status) for status in FlowStatus}
+
+class ConnState(IntEnum):
+    """連線狀態 (由 connection_status_signal 的字串轉換而來，供邏輯判斷使用)"""
+    DISCONNECTED = 0
+    CONNECTING = 1
+    CONNECTED = 2
+    ERROR = 3
+
+# connection_status_signal 字串 -> 連線狀態；其餘 ("Error: ...") 視為 ERROR
+_CONN_STATE_BY_TEXT = {
+    "Disconnected": ConnState.DISCONNECTED,
+    "Connecting": ConnState.CONNECTING,
+    "Connected": ConnState.CONNECTED,
+}
+
+# 步驟列表: 流程類型 -> (列出的步驟範圍, GroupBox 標題)
+_STEP_LIST_LAYOUT = {
+    'normal': (range(1, 39), "作業項目流程 (正常)"),
+    'recovery': (range(101, 125), "作業項目流程 (恢復)"), # 恢復流程步驟範圍
+}
+
+@functools.lru_cache(maxsize=None)
+def _shared_font(family, size):
+    """取得共用的 QFont，同一字型只建立一次 (需在 QApplication 建立後呼叫)"""
+    return QFont(family, size)
+
+# 連線狀態標籤/連線按鈕的樣式只設定一次，狀態切換時改動態屬性 "state" 並重新套用
+_CONN_LABEL_QSS = ('QLabel[state="ok"] { color: green; font-weight: bold; }'
+                   'QLabel[state="busy"] { color: orange; font-weight: bold; }'
+                   'QLabel[state="err"] { color: red; font-weight: bold; }')
+_CONN_BUTTON_QSS = ('QPushButton[state="connect"] { background-color: lightgreen; }'
+                    'QPushButton[state="disconnect"] { background-color: lightcoral; }')
+
+@functools.lru_cache(maxsize=None)
+def _log_format(color):
+    """取得日誌顏色對應的 QTextCharFormat，每種顏色只建立一次"""
+    fmt = QTextCharFormat()
+    fmt.setForeground(QColor(color))
+    return fmt
+
 # --- 網路通訊執行緒 (EFemClientThread) ---
+@functools.lru_cache(maxsize=256)
+def _frame(command):
+    """將指令包裝為 '#指令$' 協定封包 (快取已編碼的位元組)"""
+    return b"#" + command.encode('utf-8') + b"$"
+
 # (省略...)
 class EFemClientThread(QThread):
     """處理與 EFEM 的 TCP/IP 通訊"""
     # 信號定義
     connection_status_signal = pyqtSignal(str) # 'Connected', 'Disconnected', 'Connecting', 'Error: ...'
-    received_data_signal = pyqtSignal(str)     # 收到的原始資料
-    log_signal = pyqtSignal(str, str)          # (訊息, 顏色)
+    received_data_signal = pyqtSignal(list)    # 收到的原始資料 (同一次 recv 切出的訊息合併為一批)
+    log_signal = pyqtSignal(list)              # [(訊息, 顏色), ...] 每輪收發整批發送一次
 
     def __init__(self, ip, port):
         super().__init__()
@@ -111,29 +272,59 @@ class EFemClientThread(QThread):
         self.port = port
         self.sock = None
         self.is_running = False
-        self.command_queue = queue.Queue() # 用於從主執行緒接收指令
+        # 用於從主執行緒接收指令；單一生產者 (GUI) / 單一消費者 (本執行緒)，
+        # deque 的 append/popleft 本身即為原子操作，不需 queue.Queue 的鎖
+        self.command_queue = deque()
+        self._rxbuf = bytearray() # 接收緩衝，保留尚未收到 '$' 的不完整訊息
+        self._rxchunk = bytearray(BUFFER_SIZE) # recv_into 重複使用的接收區，每次讀取不必配置新的 bytes
+        self._rxchunk_view = memoryview(self._rxchunk)
+        self._sel = selectors.DefaultSelector() # 連線後註冊一次 (Linux 為 epoll)，不必每輪重建 select 清單
+        self.log_verbose = True # 是否記錄每筆收發內容 (由 UI「記錄收發內容」切換)
+        # 執行中流程的回應入口 (set_efem_response)；設定後 OK/Error 回應在本執行緒直接放入流程的佇列，不經 GUI 執行緒轉送
+        # (流程的 stop 也會從 GUI 執行緒放入停止訊號，該佇列須容許多個生產者)
+        self.response_sink = None
+        self._log_batch = [] # 本輪收發累積的 (訊息, 顏色)，由 _flush_log 整批送出
+
+    def _log(self, message, color):
+        """暫存一筆日誌，由 _flush_log 整批送出"""
+        self._log_batch.append((message, color))
+
+    def _flush_log(self):
+        """將暫存的日誌一次發送到 GUI (每輪收發結束時呼叫)"""
+        if self._log_batch:
+            self.log_signal.emit(self._log_batch)
+            self._log_batch = []
 
     def connect_to_efem(self):
         """嘗試連接到 EFEM"""
-        self.log_signal.emit(f"嘗試連線到 {self.ip}:{self.port}...", "blue")
+        self._log(f"嘗試連線到 {self.ip}:{self.port}...", "blue")
         self.connection_status_signal.emit("Connecting")
         try:
             self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_RCVBUF) # 需在 connect 前設定
             self.sock.settimeout(CONNECT_TIMEOUT) # 設定連線超時
             self.sock.connect((self.ip, self.port))
+            # 指令/回應皆為短封包：關閉 Nagle 避免延遲；開啟 keepalive 以偵測 EFEM 無聲斷線
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            if hasattr(socket, "TCP_KEEPIDLE"): # Linux 才有的細部參數
+                self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, KEEPALIVE_IDLE)
+                self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, KEEPALIVE_INTERVAL)
+                self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, KEEPALIVE_COUNT)
             self.sock.settimeout(None) # 取消超時，改為阻塞接收
+            self._rxbuf.clear() # 捨棄前一次連線殘留的不完整訊息
             self.is_running = True
             self.connection_status_signal.emit("Connected")
-            self.log_signal.emit("連線成功.", "green")
+            self._log("連線成功.", "green")
             return True
         except socket.timeout:
-            self.log_signal.emit(f"連線超時 ({CONNECT_TIMEOUT}秒).", "red")
+            self._log(f"連線超時 ({CONNECT_TIMEOUT}秒).", "red")
             self.connection_status_signal.emit(f"Error: 連線超時")
             self.sock = None
             return False
         except Exception as e:
             error_msg = f"連線錯誤: {e}"
-            self.log_signal.emit(error_msg, "red")
+            self._log(error_msg, "red")
             self.connection_status_signal.emit(f"Error: {e}")
             self.sock = None
             return False
@@ -141,92 +332,143 @@ class EFemClientThread(QThread):
     def send_command(self, command):
         """將指令放入佇列等待發送"""
         if command:
-            self.command_queue.put(command)
+            self.command_queue.append(command)
 
     def _send(self, command):
         """實際發送指令 (在執行緒內部呼叫)"""
         if self.sock and self.is_running:
             try:
-                formatted_command = f"#{command}$".encode('utf-8')
-                self.sock.sendall(formatted_command)
-                self.log_signal.emit(f"發送: #{command}$", "purple")
+                self.sock.sendall(_frame(command))
+                if self.log_verbose:
+                    self._log(f"發送: #{command}$", "purple")
+                    self._flush_log() # 回應可能經 response_sink 直接交給流程，發送日誌需先送出
                 return True
             except Exception as e:
                 error_msg = f"發送指令 '{command}' 失敗: {e}"
-                self.log_signal.emit(error_msg, "red")
+                self._log(error_msg, "red")
+                self._flush_log() # stop() 直接發送，先送出之前的日誌以維持順序
                 self.stop() # Assume connection lost on send error
                 return False
         else:
-            self.log_signal.emit(f"無法發送 '{command}': 未連線.", "orange")
+            self._log(f"無法發送 '{command}': 未連線.", "orange")
             return False
 
     def run(self):
         """執行緒主循環：連接、發送指令、接收資料"""
-        if not self.connect_to_efem():
+        connected = self.connect_to_efem()
+        self._flush_log()
+        if not connected:
+            self._sel.close()
             return # 連線失敗則退出執行緒
+        self._sel.register(self.sock, selectors.EVENT_READ)
 
         while self.is_running:
             # 檢查是否有指令要發送
             try:
-                command_to_send = self.command_queue.get_nowait()
-                if not self._send(command_to_send):
-                    break # 發送失敗則退出
-            except queue.Empty:
-                pass # 沒有指令要發送，繼續接收
+                command_to_send = self.command_queue.popleft()
+            except IndexError: # 沒有指令要發送 (stop() 也可能在 GUI 執行緒同時清空佇列)
+                command_to_send = None
+            if command_to_send is not None and not self._send(command_to_send):
+                break # 發送失敗則退出
 
             # 嘗試接收資料
             try:
-                # 使用 select 實現非阻塞檢查是否有資料可讀
-                import select
-                ready_to_read, _, _ = select.select([self.sock], [], [], 0.1) # 100ms 超時
-
-                if ready_to_read:
-                    data_bytes = self.sock.recv(BUFFER_SIZE)
-                    if data_bytes:
+                # 以 selector 檢查是否有資料可讀
+                if self._sel.select(timeout=0.1): # 100ms 超時
+                    # 直接讀入預先配置的接收區
+                    nbytes = self.sock.recv_into(self._rxchunk)
+                    if nbytes:
+                        # 以位元組緩衝累積資料，僅在收到完整 '$' 結尾的訊息時才切出，
+                        # 避免一則訊息被拆成兩次 recv 時遭到截斷
+                        self._rxbuf += self._rxchunk_view[:nbytes]
+                        # 接收區被填滿表示 socket 可能還有資料：以 select(0) 確認後繼續讀 (不阻塞)，
+                        # 同一輪讀完再一起切訊息，連發的大量訊息只需一次喚醒
+                        while nbytes == BUFFER_SIZE and self._sel.select(timeout=0):
+                            nbytes = self.sock.recv_into(self._rxchunk)
+                            self._rxbuf += self._rxchunk_view[:nbytes]
                         try:
-                            # 嘗試用 UTF-8 解碼，如果失敗則用預設方式 (可能包含原始位元組)
-                            raw_data = data_bytes.decode('utf-8', errors='replace')
                             # --- 資料處理 ---
-                            # EFEM 回應可能包含多個以 '$' 分隔的訊息
-                            parts = raw_data.split('$')
                             full_message = ""
-                            for part in parts:
-                                if part.strip(): # 忽略空部分
-                                    # 重新加上結束符號以便解析
-                                    message = part.strip() + "$"
+                            batch = []
+                            start = 0
+                            end = self._rxbuf.find(b'$')
+                            with memoryview(self._rxbuf) as view: # 直接在緩衝上切片，不建立中間 bytearray
+                                while end >= 0:
+                                    frame = view[start:end].tobytes().strip()
+                                    start = end + 1
+                                    end = self._rxbuf.find(b'$', start)
                                     # 去掉起始的 '#' (如果有的話)
-                                    if message.startswith('#'):
-                                        message = message[1:]
-                                    self.received_data_signal.emit(message)
-                                    full_message += message # 用於日誌
+                                    if frame[:1] == b'#':
+                                        frame = frame[1:]
+                                    if frame: # 忽略空部分
+                                        # 重新加上結束符號以便解析；協定訊息多為純 ASCII，走較快的解碼路徑
+                                        if frame.isascii():
+                                            message = frame.decode('ascii') + "$"
+                                        else:
+                                            message = frame.decode('utf-8', errors='replace') + "$"
+                                        is_reply = not message.startswith("Event,") and \
+                                                   (",OK" in message or ",Error," in message)
+                                        if self.log_verbose:
+                                            full_message += message # 用於日誌
+                                        sink = self.response_sink
+                                        if sink is not None and is_reply:
+                                            # 流程收到回應後會立即記錄結果，先送出目前的發送/收到日誌以維持順序
+                                            if full_message:
+                                                self._log(f"收到: {full_message.rstrip('$')}", "blue")
+                                                full_message = ""
+                                            self._flush_log()
+                                            sink(message)
+                                        if is_reply and ",OK" not in message:
+                                            # 錯誤回應在此查表並格式化，GUI 執行緒只需附加日誌；
+                                            # 先送出之前的日誌與訊息以維持日誌順序
+                                            if full_message:
+                                                self._log(f"收到: {full_message.rstrip('$')}", "blue")
+                                                full_message = ""
+                                            self._flush_log()
+                                            if batch:
+                                                self.received_data_signal.emit(batch)
+                                                batch = []
+                                            self._log(_format_error_reply(message), "red")
+                                        else:
+                                            batch.append(message)
+                            del self._rxbuf[:start] # 一次移除所有已處理的完整訊息
+                            self._flush_log() # 錯誤回應的日誌需排在其後的訊息之前
+                            if batch: # 整批送往 GUI 執行緒，每次 recv 最多一次跨執行緒呼叫
+                                self.received_data_signal.emit(batch)
                             if full_message:
-                                self.log_signal.emit(f"收到: {full_message.rstrip('$')}", "blue")
+                                self._log(f"收到: {full_message.rstrip('$')}", "blue")
 
                         except UnicodeDecodeError:
-                             self.log_signal.emit(f"收到無法解碼的資料: {data_bytes!r}", "orange")
-                             self.received_data_signal.emit(f"RAW_DATA:{data_bytes!r}") # 發送原始資料標記
+                             data_bytes = bytes(self._rxchunk_view[:nbytes])
+                             self._log(f"收到無法解碼的資料: {data_bytes!r}", "orange")
+                             self.received_data_signal.emit([f"RAW_DATA:{data_bytes!r}"]) # 發送原始資料標記
                     else:
                         # 對方關閉連線
-                        self.log_signal.emit("偵測到遠端連線關閉.", "orange")
+                        self._log("偵測到遠端連線關閉.", "orange")
+                        self._flush_log()
                         self.stop()
                         break
             except socket.error as e:
                 # 連線中斷等錯誤
                 if self.is_running: # 避免重複報告已手動停止的錯誤
-                    self.log_signal.emit(f"接收錯誤: {e}", "red")
+                    self._log(f"接收錯誤: {e}", "red")
+                    self._flush_log()
                     self.stop()
                 break
             except Exception as e:
                  if self.is_running:
-                    self.log_signal.emit(f"執行緒發生未預期錯誤: {e}", "red")
+                    self._log(f"執行緒發生未預期錯誤: {e}", "red")
                     # Consider stopping based on error type
                     # self.stop()
                  break
 
+            self._flush_log() # 本輪的收發日誌整批送出
+
             # 短暫休眠避免 CPU 占用過高
             # time.sleep(0.01) # select 已經有超時，可能不需要
 
         # 執行緒結束前的清理
+        self._sel.close() # 一併取消 socket 的註冊
         if self.sock:
             try:
                 self.sock.close()
@@ -235,24 +477,48 @@ class EFemClientThread(QThread):
         self.sock = None
         if self.is_running: # 如果不是被外部 stop() 呼叫而結束
             self.connection_status_signal.emit("Disconnected")
-            self.log_signal.emit("連線已中斷.", "red")
+            self._log("連線已中斷.", "red")
+        self._flush_log()
         self.is_running = False # 確保狀態更新
 
     def stop(self):
         """停止執行緒並關閉連線"""
         if self.is_running:
-            self.log_signal.emit("正在停止通訊執行緒...", "orange")
+            self.log_signal.emit([("正在停止通訊執行緒...", "orange")]) # 可能由 GUI 執行緒呼叫，直接發送
             self.is_running = False
             # 清空指令佇列，避免關閉後還嘗試發送
-            while not self.command_queue.empty():
-                try:
-                    self.command_queue.get_nowait()
-                except queue.Empty:
-                    break
+            self.command_queue.clear()
             # 不需要 join，因為 run() 循環會自己結束
             self.connection_status_signal.emit("Disconnected") # 確保 UI 更新
 
 # --- 流程控制執行緒 (FlowControlThread) ---
+class _SpscQueue:
+    """多生產者 (通訊執行緒的回應、GUI 執行緒的 stop) / 單一消費者 (流程執行緒) 的回應佇列，以 deque + Event 取代 queue.Queue
+    (deque.append 與 Event.set 皆為執行緒安全，get 在清除事件後會重新檢查佇列，不會漏接)"""
+    def __init__(self, maxlen=128):
+        self._dq = deque(maxlen=maxlen)
+        self._ev = threading.Event()
+
+    def put(self, item):
+        self._dq.append(item)
+        self._ev.set()
+
+    def get(self, timeout=None):
+        """取出最早的一筆，逾時回傳 None"""
+        while not self._dq:
+            if not self._ev.wait(timeout): return None
+            self._ev.clear()
+        return self._dq.popleft()
+
+def _require_ok(status, step_num):
+    """指令狀態不是 OK 時以 RuntimeError 中止流程"""
+    if status != "OK":
+        raise RuntimeError(f"步驟 {step_num} 未收到 OK: {status}")
+
+# 流程步驟表的一列；parser 為 None 時只需確認指令回覆 OK
+FlowStep = namedtuple('FlowStep', 'num command parser confirm_type confirm_num store_as',
+                      defaults=(None, None, None, None))
+
 # (省略...)
 class FlowControlThread(QThread):
     """管理【正常】自動化流程的狀態機"""
@@ -260,62 +526,64 @@ class FlowControlThread(QThread):
     request_confirmation_signal = pyqtSignal(str, str)
     send_efem_command_signal = pyqtSignal(str)
     flow_finished_signal = pyqtSignal(int)
-    log_signal = pyqtSignal(str, str)
+    log_signal = pyqtSignal(list) # [(訊息, 顏色), ...] 整批跨執行緒發送
 
     def __init__(self, num_loadports=1, num_aligners=1, num_ocrs=1):
         super().__init__()
         self.is_running = False
         self.current_pdf_step = 0
-        self.efem_response_queue = queue.Queue(maxsize=1)
-        self.user_confirmation_queue = queue.Queue(maxsize=1)
+        self._resp_q = _SpscQueue() # EFEM 回應依序排隊
+        # 使用者確認以單一槽位交接：新資料直接覆蓋舊資料，Event 負責喚醒等待方
+        self._conf_slot = None
+        self._conf_evt = threading.Event()
+        self._stop_evt = threading.Event() # stop() 時設定，讓等待立即返回
+        self._log_batch = [] # 尚未發送的日誌
         self.num_loadports = num_loadports
         self.current_slot = 1
         self.max_slots = 25
         self.map_result_data = ""
+        self._map_bytes = b"" # 每個 Slot 一個位元組的 Map 資料
         # 不再需要 self.step_descriptions
 
     # set_efem_response, set_user_confirmation, _wait_for_efem_response,
     # _wait_for_user_confirmation, _send_cmd_and_wait, _request_user_confirm,
-    # run, stop, parse_*, check_slot_has_wafer
+    # run, stop, parse_*, wafer_slots
     # (邏輯與 v1.11 基本相同，但 run 方法中的步驟編號和描述獲取使用全局函數，
     #  且不再發送 visual_update_signal，此處省略以節省空間)
+    def _log(self, message, color):
+        """暫存一筆日誌，由 _flush_log 整批送出"""
+        self._log_batch.append((message, color))
+
+    def _flush_log(self):
+        """將暫存的日誌一次發送到 GUI (在阻塞等待前、發送步驟/確認/結束信號前呼叫)"""
+        if self._log_batch:
+            self.log_signal.emit(self._log_batch)
+            self._log_batch = []
+
     def set_efem_response(self, data):
-        """從主執行緒接收 EFEM 回應"""
-        try:
-            while not self.efem_response_queue.empty(): self.efem_response_queue.get_nowait()
-            self.efem_response_queue.put(data, block=False)
-        except queue.Full:
-            self.log_signal.emit("警告: EFEM 回應佇列已滿，可能遺失回應", "orange")
+        """接收 EFEM 回應 (由通訊執行緒直接呼叫，stop 時由主執行緒放入停止訊號)"""
+        self._resp_q.put(data)
 
     def set_user_confirmation(self, result):
         """從主執行緒接收使用者確認結果"""
-        try:
-            while not self.user_confirmation_queue.empty(): self.user_confirmation_queue.get_nowait()
-            self.user_confirmation_queue.put(result, block=False)
-        except queue.Full:
-             self.log_signal.emit("警告: 使用者確認佇列已滿", "orange")
+        self._conf_slot = result
+        self._conf_evt.set()
 
     def _wait_for_efem_response(self, timeout=COMMAND_TIMEOUT):
-        """等待 EFEM 回應 (檢查停止標誌)"""
-        start_time = time.monotonic()
-        while time.monotonic() - start_time < timeout:
-            if not self.is_running: return "STOP_REQUESTED"
-            try:
-                return self.efem_response_queue.get(timeout=0.1)
-            except queue.Empty:
-                continue
-        return None # 超時
+        """等待 EFEM 回應 (stop() 會立即喚醒)"""
+        self._flush_log()
+        response = self._resp_q.get(timeout)
+        if response is None: return None # 超時
+        if self._stop_evt.is_set(): return "STOP_REQUESTED"
+        return response
 
     def _wait_for_user_confirmation(self, timeout=CONFIRMATION_TIMEOUT):
-        """等待使用者確認 (檢查停止標誌)"""
-        start_time = time.monotonic()
-        while time.monotonic() - start_time < timeout:
-             if not self.is_running: return "STOP_REQUESTED"
-             try:
-                 return self.user_confirmation_queue.get(timeout=0.1)
-             except queue.Empty:
-                 continue
-        return None # 超時
+        """等待使用者確認 (stop() 會立即喚醒)"""
+        self._flush_log()
+        if not self._conf_evt.wait(timeout): return None # 超時
+        self._conf_evt.clear()
+        if self._stop_evt.is_set(): return "STOP_REQUESTED"
+        return self._conf_slot
 
     def _send_cmd_and_wait(self, command, pdf_step_num_action, **kwargs):
         """發送指令並等待 'OK' 回應的輔助函數，使用 PDF 動作步驟編號"""
@@ -323,33 +591,38 @@ class FlowControlThread(QThread):
 
         self.current_pdf_step = pdf_step_num_action
         step_desc = get_step_description(pdf_step_num_action, **kwargs) # 使用全局函數
+        self._flush_log() # 先送出之前的日誌，GUI 的步驟紀錄才不會排到前面
         self.update_step_signal.emit(pdf_step_num_action) # 高亮動作步驟
-        self.log_signal.emit(f"步驟 {pdf_step_num_action}: {step_desc} (發送: {command})", "darkMagenta")
+        self._log(f"步驟 {pdf_step_num_action}: {step_desc} (發送: {command})", "darkMagenta")
         self.send_efem_command_signal.emit(command)
 
         # 更新狀態為等待回應 (高亮等待步驟)
         pdf_step_num_wait = pdf_step_num_action + 1
-        wait_desc = get_step_description(pdf_step_num_wait, **kwargs) # 使用全局函數
-        if "等待" in wait_desc or "回覆" in wait_desc: # 檢查描述是否為等待/回覆類型
+        if pdf_step_num_wait in _CMD_WAIT_STEPS: # 檢查是否為等待/回覆類型
+             wait_desc = get_step_description(pdf_step_num_wait, **kwargs) # 使用全局函數
+             self._flush_log()
              self.update_step_signal.emit(pdf_step_num_wait) # 高亮等待步驟
-             self.log_signal.emit(f"步驟 {pdf_step_num_wait}: {wait_desc}", "darkMagenta")
+             self._log(f"步驟 {pdf_step_num_wait}: {wait_desc}", "darkMagenta")
 
         response = self._wait_for_efem_response()
 
         if response == "STOP_REQUESTED":
-            self.log_signal.emit(f"指令 '{command}' 在等待回應時被中止", "orange")
+            self._log(f"指令 '{command}' 在等待回應時被中止", "orange")
             return None, "Stopped"
         if response is None:
-            self.log_signal.emit(f"錯誤: 等待 '{command}' 回應超時 ({COMMAND_TIMEOUT}秒)", "red")
+            self._log(f"錯誤: 等待 '{command}' 回應超時 ({COMMAND_TIMEOUT}秒)", "red")
             return None, "Timeout"
         if ",OK" in response:
-             self.log_signal.emit(f"指令 '{command}' 成功: {response.strip()}", "green")
+             self._log(f"指令 '{command}' 成功: {response.strip()}", "green")
              return response, "OK"
-        elif ",Error," in response:
-            self.log_signal.emit(f"錯誤: 指令 '{command}' 收到錯誤回應: {response.strip()}", "red")
-            return None, "EFEM Error"
+        m = _ERR_RE.search(response)
+        if m:
+            code = m.group(1)
+            error_desc = _error_desc(code)
+            self._log(f"錯誤: 指令 '{command}' 收到錯誤回應: {response.strip()} ({error_desc})", "red")
+            return None, f"EFEM Error {code}: {error_desc}"
         else:
-            self.log_signal.emit(f"警告: 指令 '{command}' 收到非 OK 回應: {response.strip()}", "orange")
+            self._log(f"警告: 指令 '{command}' 收到非 OK 回應: {response.strip()}", "orange")
             return None, "Not OK"
 
     def _request_user_confirm(self, confirm_type, data, pdf_step_num_request, **kwargs):
@@ -358,190 +631,173 @@ class FlowControlThread(QThread):
 
         self.current_pdf_step = pdf_step_num_request
         step_desc = get_step_description(pdf_step_num_request, **kwargs) # 使用全局函數
+        self._flush_log()
         self.update_step_signal.emit(pdf_step_num_request) # 高亮請求步驟
-        self.log_signal.emit(f"步驟 {pdf_step_num_request}: {step_desc} ({confirm_type}: {data})", "darkMagenta")
+        self._log(f"步驟 {pdf_step_num_request}: {step_desc} ({confirm_type}: {data})", "darkMagenta")
+        self._flush_log()
         self.request_confirmation_signal.emit(confirm_type, data)
 
         # 更新狀態為等待使用者回應 (高亮等待步驟)
         pdf_step_num_wait = pdf_step_num_request + 1
-        wait_desc = get_step_description(pdf_step_num_wait, **kwargs) # 使用全局函數
-        if "等待" in wait_desc or "正確" in wait_desc: # 檢查描述是否為等待/確認類型
+        if pdf_step_num_wait in _CONFIRM_WAIT_STEPS: # 檢查是否為等待/確認類型
+             wait_desc = get_step_description(pdf_step_num_wait, **kwargs) # 使用全局函數
+             self._flush_log()
              self.update_step_signal.emit(pdf_step_num_wait) # 高亮等待步驟
-             self.log_signal.emit(f"步驟 {pdf_step_num_wait}: {wait_desc}", "darkMagenta")
+             self._log(f"步驟 {pdf_step_num_wait}: {wait_desc}", "darkMagenta")
 
         confirmation = self._wait_for_user_confirmation()
 
         if confirmation == "STOP_REQUESTED": return False, "Stopped"
         if confirmation is None:
-            self.log_signal.emit(f"錯誤: 等待使用者確認 '{confirm_type}' 超時 ({CONFIRMATION_TIMEOUT}秒)", "red")
+            self._log(f"錯誤: 等待使用者確認 '{confirm_type}' 超時 ({CONFIRMATION_TIMEOUT}秒)", "red")
             return False, "Timeout"
         if confirmation:
-            self.log_signal.emit(f"使用者確認 '{confirm_type}' 資料正確", "green")
+            self._log(f"使用者確認 '{confirm_type}' 資料正確", "green")
             return True, "Confirmed"
         else:
-            self.log_signal.emit(f"使用者確認 '{confirm_type}' 資料錯誤", "orange")
+            self._log(f"使用者確認 '{confirm_type}' 資料錯誤", "orange")
             return False, "Rejected"
 
+    def _run_step(self, step, **kwargs):
+        """執行步驟表中的一個步驟：發送指令、解析回應，需要時請求使用者核對"""
+        command = step.command.format(**kwargs) if kwargs else step.command
+        response, status = self._send_cmd_and_wait(command, step.num, **kwargs)
+        _require_ok(status, step.num)
+        if step.parser is None:
+            return
+        data = step.parser(self, response)
+        if step.store_as:
+            setattr(self, step.store_as, data)
+        # PDF 核對步驟: 過長的資料 (如 Map) 只顯示前 50 字元
+        display_data = data[:50] + "..." if len(data) > 50 else data
+        confirmed, confirm_status = self._request_user_confirm(step.confirm_type, display_data, step.confirm_num)
+        if not confirmed: raise RuntimeError(f"步驟 {step.confirm_num} 使用者拒絕或超時: {confirm_status}")
+
     def run(self):
         """執行【正常】流程狀態機"""
         self.is_running = True
         self.current_slot = 1
         error_occurred = False
-        final_status_code = 0 # 初始狀態碼
+        final_status_code = FlowStatus.IDLE # 初始狀態碼
 
         try:
-            self.log_signal.emit("自動流程啟動...", "green")
+            self._log("自動流程啟動...", "green")
+            self._flush_log()
             self.update_step_signal.emit(0) # 顯示待命
 
-            # PDF 步驟 5: 讀取RFID命令 (ReadFoupID)
-            response, status = self._send_cmd_and_wait("ReadFoupID,Loadport1", 5)
-            if status == "OK":
-                rfid = self.parse_rfid(response)
-                # PDF 步驟 7: RFID資料核對
-                confirmed, confirm_status = self._request_user_confirm("RFID", rfid, 7)
-                if not confirmed: raise RuntimeError(f"步驟 7 使用者拒絕或超時: {confirm_status}")
-            else:
-                raise RuntimeError(f"步驟 5 未收到 OK: {status}")
-
-            # PDF 步驟 9: 開門命令 (Load)
-            _, status = self._send_cmd_and_wait("Load,Loadport1", 9)
-            if status != "OK": raise RuntimeError(f"步驟 9 未收到 OK: {status}")
-
-            # PDF 步驟 11: Slot Mapping (GetMapResult)
-            response, status = self._send_cmd_and_wait("GetMapResult,Loadport1", 11)
-            if status == "OK":
-                 self.map_result_data = self.parse_map_result(response)
-                 # PDF 步驟 13: 層數資料核對
-                 display_map = self.map_result_data[:50] + "..." if len(self.map_result_data) > 50 else self.map_result_data
-                 confirmed, confirm_status = self._request_user_confirm("Map Result", display_map, 13)
-                 if not confirmed: raise RuntimeError(f"步驟 13 使用者拒絕或超時: {confirm_status}")
-            else:
-                 raise RuntimeError(f"步驟 11 未收到 OK: {status}")
+            # PDF 步驟 5~13: 讀取RFID、開門、Slot Mapping (含使用者核對)
+            for step in self.PREPARE_STEPS:
+                self._run_step(step)
 
             # --- Wafer 處理循環 ---
-            while self.current_slot <= self.max_slots:
+            # 依 Map 結果一次列出有 Wafer 的 Slot，空 Slot 不再逐一進入循環
+            slots_todo = self.wafer_slots(self.map_result_data)
+            if slots_todo is None:
+                slots_todo = [] # Map 無效 (警告已記錄)，不列出跳過的 Slot
+            elif len(slots_todo) < self.max_slots:
+                skipped = sorted(set(range(1, self.max_slots + 1)).difference(slots_todo))
+                self._log(f"流程: Slot {', '.join(map(str, skipped))} 無 Wafer，跳過", "gray")
+            for slot in slots_todo:
                 if not self.is_running: raise StopIteration("流程中止")
+                self.current_slot = slot
 
-                has_wafer = self.check_slot_has_wafer(self.map_result_data, self.current_slot)
-                if not has_wafer:
-                    self.log_signal.emit(f"流程: Slot {self.current_slot} 無 Wafer，跳過", "gray")
-                    self.current_slot += 1
-                    continue
-
-                self.log_signal.emit(f"流程: 開始處理 Slot {self.current_slot}", "blue")
-
-                # PDF 步驟 15: 取LOADPORT1第{slot}層
-                get_cmd = f"SmartGet,Robot1,UpArm,Loadport1,{self.current_slot}"
-                _, status = self._send_cmd_and_wait(get_cmd, 15, slot=self.current_slot)
-                if status != "OK": raise RuntimeError(f"步驟 15 未收到 OK: {status}")
-
-                # PDF 步驟 17: 送片至ALIGNER
-                put_cmd = "SmartPut,Robot1,UpArm,Aligner1,1"
-                _, status = self._send_cmd_and_wait(put_cmd, 17)
-                if status != "OK": raise RuntimeError(f"步驟 17 未收到 OK: {status}")
-
-                # PDF 步驟 19: ALIGNER進行Align
-                _, status = self._send_cmd_and_wait("Alignment,Aligner1", 19)
-                if status != "OK": raise RuntimeError(f"步驟 19 未收到 OK: {status}")
-
-                # PDF 步驟 21: 讀取OCR
-                response, status = self._send_cmd_and_wait("ReadID,OCR1", 21)
-                if status == "OK":
-                    ocr_id = self.parse_ocr_result(response)
-                    # PDF 步驟 23: OCR核對
-                    confirmed, confirm_status = self._request_user_confirm("OCR", ocr_id, 23)
-                    if not confirmed: raise RuntimeError(f"步驟 23 使用者拒絕或超時: {confirm_status}")
-                else:
-                     raise RuntimeError(f"步驟 21 未收到 OK: {status}")
-
-                # PDF 步驟 25: 從ALIGNER取片
-                get_cmd = "SmartGet,Robot1,UpArm,Aligner1,1"
-                _, status = self._send_cmd_and_wait(get_cmd, 25)
-                if status != "OK": raise RuntimeError(f"步驟 25 未收到 OK: {status}")
+                self._log(f"流程: 開始處理 Slot {self.current_slot}", "blue")
 
-                # PDF 步驟 27: 放片至STAGE
-                put_cmd = "SmartPut,Robot1,UpArm,Stage1,1"
-                _, status = self._send_cmd_and_wait(put_cmd, 27)
-                if status != "OK": raise RuntimeError(f"步驟 27 未收到 OK: {status}")
+                # PDF 步驟 15~27: 取片 -> Aligner -> OCR 核對 -> 放至 STAGE
+                for step in self.SLOT_STEPS:
+                    self._run_step(step, slot=self.current_slot)
 
-                self.log_signal.emit(f"流程: Slot {self.current_slot} 處理完成", "green")
-                self.current_slot += 1
+                self._log(f"流程: Slot {self.current_slot} 處理完成", "green")
 
             # --- 循環結束 ---
+            self._flush_log()
             self.update_step_signal.emit(32) # 更新到檢查/準備 Unload 步驟
 
             # PDF 步驟 33: 關門命令 (Unload)
-            _, status = self._send_cmd_and_wait("Unload,Loadport1", 33)
-            if status != "OK": raise RuntimeError(f"步驟 33 未收到 OK: {status}")
+            for step in self.FINISH_STEPS:
+                self._run_step(step)
 
-            final_status_code = 99 # 完成狀態碼
+            final_status_code = FlowStatus.DONE # 完成狀態碼
 
         except StopIteration as e:
-            final_status_code = -2 # 使用者中止
-            self.log_signal.emit(f"流程已中止: {e}", "orange")
+            final_status_code = FlowStatus.USER_STOP # 使用者中止
+            self._log(f"流程已中止: {e}", "orange")
         except RuntimeError as e:
-            final_status_code = -1 # 錯誤中止
-            self.log_signal.emit(f"流程錯誤中止: {e}", "red")
+            final_status_code = FlowStatus.ERROR # 錯誤中止
+            self._log(f"流程錯誤中止: {e}", "red")
             error_occurred = True
         except Exception as e:
-             final_status_code = -1 # 未預期錯誤
-             self.log_signal.emit(f"流程發生未預期錯誤: {e}", "red")
+             final_status_code = FlowStatus.ERROR # 未預期錯誤
+             self._log(f"流程發生未預期錯誤: {e}", "red")
              error_occurred = True
         finally:
             self.is_running = False
-            final_desc = get_step_description(final_status_code) # 使用全局函數
+            final_desc = final_status_code.desc
+            self._log(f"【正常流程】結束 ({final_desc}).", "green" if not error_occurred else "red")
+            self._flush_log() # 結束訊息需排在流程結束信號之前
             self.update_step_signal.emit(final_status_code) # 發送最終狀態碼
             self.flow_finished_signal.emit(final_status_code) # 發送最終狀態碼
-            self.log_signal.emit(f"【正常流程】結束 ({final_desc}).", "green" if not error_occurred else "red")
 
 
     def stop(self):
         """停止流程執行"""
         if self.is_running:
-            self.log_signal.emit("正在中止自動流程...", "orange")
+            self.log_signal.emit([("正在中止自動流程...", "orange")]) # 由 GUI 執行緒呼叫，直接發送
             self.is_running = False
-            try: self.efem_response_queue.put_nowait("STOP_REQUESTED")
-            except queue.Full: pass
-            try: self.user_confirmation_queue.put_nowait(False)
-            except queue.Full: pass
+            self._stop_evt.set()
+            # 喚醒正在等待的步驟
+            self.set_efem_response("STOP_REQUESTED")
+            self.set_user_confirmation(False)
 
     def parse_rfid(self, response):
         """從 ReadFoupID 回應中解析 RFID"""
-        parts = response.strip().rstrip('$').split(',')
-        if len(parts) == 4 and parts[2] == "OK":
-            return parts[3]
+        m = _RESP_RE.match(response)
+        if m and m.group(3) == "OK" and "," not in m.group(4):
+            return m.group(4)
         return "解析錯誤"
 
     def parse_map_result(self, response):
         """從 GetMapResult 回應中解析 Map Data"""
-        parts = response.strip().rstrip('$').split(',')
-        if len(parts) >= 4 and parts[2] == "OK":
-            return ",".join(parts[3:])
-        return "解析錯誤"
+        map_data, self._map_bytes = _parse_map(response) # 解析一次，供 wafer_slots 直接索引
+        return map_data
 
     def parse_ocr_result(self, response):
         """從 ReadID,OCR 回應中解析 OCR 結果"""
-        parts = response.strip().rstrip('$').split(',')
-        if len(parts) == 4 and parts[2] == "OK":
-            return parts[3]
+        m = _RESP_RE.match(response)
+        if m and m.group(3) == "OK" and "," not in m.group(4):
+            return m.group(4)
         return "解析錯誤"
 
-    def check_slot_has_wafer(self, map_data, slot_index):
-        """檢查指定 slot 是否有 wafer"""
+    def wafer_slots(self, map_data):
+        """依 Map 結果列出有 wafer 的 slot (由小到大)；Map 無效時回傳 None"""
         if not map_data or map_data == "解析錯誤":
-            self.log_signal.emit(f"警告: 無法檢查 Slot {slot_index}，Map 資料無效", "orange")
-            return False
-        slots = map_data.split(',')
-        if len(slots) == self.max_slots:
-            map_index = self.max_slots - slot_index
-            if 0 <= map_index < self.max_slots:
-                return slots[map_index] in ['1', '2', '3', '4', '5']
-            else:
-                 self.log_signal.emit(f"警告: Slot 索引 {slot_index} 計算錯誤", "orange")
-                 return False
-        else:
-             self.log_signal.emit(f"警告: Map 資料長度 {len(slots)} 與預期 {self.max_slots} 不符", "orange")
-             return False
+            self._log("警告: 無法檢查 Slot，Map 資料無效", "orange")
+            return None
+        map_bytes = self._map_bytes
+        if len(map_bytes) != self.max_slots:
+             self._log(f"警告: Map 資料長度 {len(map_bytes)} 與預期 {self.max_slots} 不符", "orange")
+             return None
+        # Map 由最高 Slot 排到 Slot 1
+        return [slot for slot in range(1, self.max_slots + 1)
+                if map_bytes[self.max_slots - slot] in _WAFER_CODES]
+
+    # --- 流程步驟表 (PDF 動作步驟編號, 指令, 回應解析, 核對類型, 核對步驟編號, 儲存屬性) ---
+    PREPARE_STEPS = (
+        FlowStep(5, "ReadFoupID,Loadport1", parse_rfid, "RFID", 7),
+        FlowStep(9, "Load,Loadport1"),
+        FlowStep(11, "GetMapResult,Loadport1", parse_map_result, "Map Result", 13, "map_result_data"),
+    )
+    SLOT_STEPS = (
+        FlowStep(15, SMART_GET_LP1_TEMPLATE),                   # 取LOADPORT1第{slot}層
+        FlowStep(17, "SmartPut,Robot1,UpArm,Aligner1,1"),       # 送片至ALIGNER
+        FlowStep(19, "Alignment,Aligner1"),                     # ALIGNER進行Align
+        FlowStep(21, "ReadID,OCR1", parse_ocr_result, "OCR", 23), # 讀取OCR並核對
+        FlowStep(25, "SmartGet,Robot1,UpArm,Aligner1,1"),       # 從ALIGNER取片
+        FlowStep(27, "SmartPut,Robot1,UpArm,Stage1,1"),         # 放片至STAGE
+    )
+    FINISH_STEPS = (
+        FlowStep(33, "Unload,Loadport1"),
+    )
 
 # --- 新增：恢復流程執行緒 ---
 class RecoveryFlowThread(QThread):
@@ -549,236 +805,284 @@ class RecoveryFlowThread(QThread):
     update_step_signal = pyqtSignal(int)       # 傳送恢復流程步驟編號 (101+)
     send_efem_command_signal = pyqtSignal(str) # 發送指令到 EFEM
     flow_finished_signal = pyqtSignal(int)     # 傳送最終狀態碼 (199=完成, -101=錯誤, -102=中止)
-    log_signal = pyqtSignal(str, str)          # (訊息, 顏色)
+    log_signal = pyqtSignal(list)              # [(訊息, 顏色), ...] 整批跨執行緒發送
 
     def __init__(self):
         super().__init__()
         self.is_running = False
         self.current_pdf_step = 101 # 恢復流程起始步驟
-        self.efem_response_queue = queue.Queue(maxsize=1)
-        self.empty_slots_lp1 = [] # 儲存 Load Port 1 的空位
+        self._resp_q = _SpscQueue() # 依序保存回應，批次發送時可能連續收到多筆
+        self._stop_evt = threading.Event() # stop() 時設定，讓等待/暫停立即返回
+        self._log_batch = [] # 尚未發送的日誌
+        self._last_emitted_step = None # 上一次送出的步驟編號，避免重複發送相同步驟
+        self.empty_slots_lp1 = deque() # 儲存 Load Port 1 的空位 (依序從前端取用)
 
     # set_efem_response, _wait_for_efem_response, stop 方法與 FlowControlThread 類似
+    def _log(self, message, color):
+        """暫存一筆日誌，由 _flush_log 整批送出"""
+        self._log_batch.append((message, color))
+
+    def _flush_log(self):
+        """將暫存的日誌一次發送到 GUI (在阻塞等待前、發送步驟/確認/結束信號前呼叫)"""
+        if self._log_batch:
+            self.log_signal.emit(self._log_batch)
+            self._log_batch = []
+
+    def _emit_step(self, step_num):
+        """發送步驟高亮；與上一次相同的步驟不再重複發送"""
+        if step_num != self._last_emitted_step:
+            self._last_emitted_step = step_num
+            self._flush_log() # 先送出之前的日誌，GUI 的步驟紀錄才不會排到前面
+            self.update_step_signal.emit(step_num)
+
     def set_efem_response(self, data):
-        try:
-            while not self.efem_response_queue.empty(): self.efem_response_queue.get_nowait()
-            self.efem_response_queue.put(data, block=False)
-        except queue.Full:
-            self.log_signal.emit("警告: (恢復流程) EFEM 回應佇列已滿", "orange")
+        self._resp_q.put(data)
 
     def _wait_for_efem_response(self, timeout=COMMAND_TIMEOUT):
-        start_time = time.monotonic()
-        while time.monotonic() - start_time < timeout:
-            if not self.is_running: return "STOP_REQUESTED"
-            try:
-                return self.efem_response_queue.get(timeout=0.1)
-            except queue.Empty:
-                continue
-        return None # 超時
+        self._flush_log()
+        response = self._resp_q.get(timeout)
+        if response is None: return None # 超時
+        if self._stop_evt.is_set(): return "STOP_REQUESTED"
+        return response
+
+    def _pause(self, seconds):
+        """暫停指定秒數；期間若收到停止請求則立即中止流程"""
+        self._flush_log()
+        if self._stop_evt.wait(seconds): raise StopIteration("流程中止")
 
     def _send_cmd_and_wait(self, command, pdf_step_num_action, **kwargs):
         """(恢復流程) 發送指令並等待 'OK' 回應"""
-        if not self.is_running: return None, "Stopped"
+        return self._send_cmd_batch([command], pdf_step_num_action, **kwargs)[0]
+
+    def _send_cmd_batch(self, commands, pdf_step_num_action, **kwargs):
+        """(恢復流程) 連續發送多個互不相依的指令，再依序收取回應，回傳 [(回應, 狀態), ...]"""
+        if not self.is_running: return [(None, "Stopped")] * len(commands)
 
         self.current_pdf_step = pdf_step_num_action
         step_desc = get_step_description(pdf_step_num_action, **kwargs) # 使用全局函數
-        self.update_step_signal.emit(pdf_step_num_action) # 高亮動作步驟
-        self.log_signal.emit(f"(恢復)步驟 {pdf_step_num_action}: {step_desc} (發送: {command})", "darkCyan")
-        self.send_efem_command_signal.emit(command)
+        self._emit_step(pdf_step_num_action) # 高亮動作步驟
+        for command in commands: # 不等回應直接送出，整批只花一次往返時間
+            self._log(f"(恢復)步驟 {pdf_step_num_action}: {step_desc} (發送: {command})", "darkCyan")
+            self.send_efem_command_signal.emit(command)
 
         # 更新狀態為等待回應 (高亮等待步驟)
         pdf_step_num_wait = pdf_step_num_action + 1
-        wait_desc = get_step_description(pdf_step_num_wait, **kwargs)
-        if "等待" in wait_desc or "回覆" in wait_desc:
-             self.update_step_signal.emit(pdf_step_num_wait)
-             self.log_signal.emit(f"(恢復)步驟 {pdf_step_num_wait}: {wait_desc}", "darkCyan")
-
-        response = self._wait_for_efem_response()
+        if pdf_step_num_wait in _CMD_WAIT_STEPS:
+             wait_desc = get_step_description(pdf_step_num_wait, **kwargs)
+             self._emit_step(pdf_step_num_wait)
+             self._log(f"(恢復)步驟 {pdf_step_num_wait}: {wait_desc}", "darkCyan")
+
+        # 依回應帶回的 (指令名, 設備) 對應到原指令，不依賴回覆順序；整批共用一個逾時期限
+        results = [None] * len(commands)
+        pending = [(_reply_key(command), i) for i, command in enumerate(commands)]
+        deadline = time.monotonic() + COMMAND_TIMEOUT
+        while pending:
+            response = self._wait_for_efem_response(max(0.0, deadline - time.monotonic()))
+            if response is None or response == "STOP_REQUESTED": # 其餘指令不會再有回應
+                for _, i in pending:
+                    results[i] = self._check_response(commands[i], response)
+                break
+            key = _reply_key(response)
+            n = next((n for n, (k, _) in enumerate(pending) if k == key), None)
+            if n is None: # 不屬於本批指令 (例如先前不等回應的指令)，記錄後捨棄，繼續等到期限
+                self._log(f"(恢復)略過不相符的回應: {response.strip()}", "gray")
+                continue
+            i = pending.pop(n)[1]
+            results[i] = self._check_response(commands[i], response)
+        return results
 
+    def _check_response(self, command, response):
+        """(恢復流程) 判斷單一指令的回應，回傳 (回應, 狀態)"""
         if response == "STOP_REQUESTED":
-            self.log_signal.emit(f"(恢復)指令 '{command}' 在等待回應時被中止", "orange")
+            self._log(f"(恢復)指令 '{command}' 在等待回應時被中止", "orange")
             return None, "Stopped"
         if response is None:
-            self.log_signal.emit(f"(恢復)錯誤: 等待 '{command}' 回應超時 ({COMMAND_TIMEOUT}秒)", "red")
+            self._log(f"(恢復)錯誤: 等待 '{command}' 回應超時 ({COMMAND_TIMEOUT}秒)", "red")
             return None, "Timeout"
         if ",OK" in response:
-             self.log_signal.emit(f"(恢復)指令 '{command}' 成功: {response.strip()}", "green")
+             self._log(f"(恢復)指令 '{command}' 成功: {response.strip()}", "green")
              return response, "OK"
-        elif ",Error," in response:
-            self.log_signal.emit(f"(恢復)錯誤: 指令 '{command}' 收到錯誤回應: {response.strip()}", "red")
-            return None, "EFEM Error"
+        m = _ERR_RE.search(response)
+        if m:
+            code = m.group(1)
+            error_desc = _error_desc(code)
+            self._log(f"(恢復)錯誤: 指令 '{command}' 收到錯誤回應: {response.strip()} ({error_desc})", "red")
+            return None, f"EFEM Error {code}: {error_desc}"
         else:
-            self.log_signal.emit(f"(恢復)警告: 指令 '{command}' 收到非 OK 回應: {response.strip()}", "orange")
+            self._log(f"(恢復)警告: 指令 '{command}' 收到非 OK 回應: {response.strip()}", "orange")
             return None, "Not OK"
 
-    def find_empty_slots(self, map_data):
-        """從 Map Data 找出空 Slot 列表"""
-        slots = []
-        if map_data and map_data != "解析錯誤":
-            map_list = map_data.split(',')
-            if len(map_list) == 25: # Assuming 25 slots
-                for i in range(25):
-                    slot_num = 25 - i
-                    if map_list[i] == '0': # 0 代表 Absence
-                        slots.append(slot_num)
-        return slots
+    def _evaluate_presence(self, items):
+        """評估 (名稱, CheckWaferPresence 回應, 是否為雙臂格式) 列表；逐一記錄仍有料片的設備，全部淨空才回傳 True"""
+        all_clear = True
+        for name, response, two_arms in items:
+            m = _PRESENCE_RE.match(response)
+            if m and (m.group(3) is not None) == two_arms and 'Presence' in m.group(2, 3):
+                self._log(f"恢復評估: {name} 上仍有料片", "red")
+                all_clear = False
+        return all_clear
+
+    def find_empty_slots(self, map_bytes):
+        """從 Map 資料 (每個 Slot 一個位元組) 找出空 Slot 列表"""
+        if len(map_bytes) != 25: # Assuming 25 slots
+            return []
+        return [25 - i for i in range(25) if map_bytes[i] == 0x30] # '0' 代表 Absence
 
     def run(self):
         """執行【恢復】流程狀態機"""
         self.is_running = True
         error_occurred = False
-        final_status_code = 101 # 恢復流程起始狀態碼
+        final_status_code = FlowStatus.RECOVERY_START # 恢復流程起始狀態碼
+        self._last_emitted_step = None
 
         try:
-            self.log_signal.emit("啟動異常恢復流程...", "blue")
-            self.update_step_signal.emit(101)
+            self._log("啟動異常恢復流程...", "blue")
+            self._emit_step(101)
 
             # 步驟 102: 檢查 Remote 模式 (假定已在 Remote 模式)
-            self.update_step_signal.emit(102)
+            self._emit_step(102)
             # 實際應使用 GetCurrentMode 檢查，此處簡化
-            self.log_signal.emit("(恢復)步驟 102: 假設已在 Remote 模式", "gray")
-            time.sleep(0.5)
+            self._log("(恢復)步驟 102: 假設已在 Remote 模式", "gray")
+            self._pause(0.5)
 
             # 步驟 103: 執行 Load Port1 狀態檢查 (GetMapResult)
             map_response, status = self._send_cmd_and_wait("GetMapResult,Loadport1", 103)
-            if status != "OK": raise RuntimeError(f"步驟 103 未收到 OK: {status}")
+            _require_ok(status, 103)
 
             # 步驟 105: 找出 Load Port1 空 Slot
-            self.update_step_signal.emit(105)
-            lp1_map_data = FlowControlThread.parse_map_result(self, map_response) # 借用解析函數
-            self.empty_slots_lp1 = self.find_empty_slots(lp1_map_data)
-            self.log_signal.emit(f"Load Port 1 空 Slot: {self.empty_slots_lp1}", "gray")
+            self._emit_step(105)
+            _, lp1_map_bytes = _parse_map(map_response)
+            empty_slots = self.find_empty_slots(lp1_map_bytes)
+            self.empty_slots_lp1 = deque(empty_slots)
+            self._log(f"Load Port 1 空 Slot: {empty_slots}", "gray")
             # 注意：如果沒有空位，後續放片會失敗
 
             # 步驟 106: 執行機械臂狀態確認 (CheckWaferPresence)
             robot_presence_response, status = self._send_cmd_and_wait("CheckWaferPresence,Robot1", 106)
-            if status != "OK": raise RuntimeError(f"步驟 106 未收到 OK: {status}")
+            _require_ok(status, 106)
 
             # 步驟 108: 檢查手臂是否有 Wafer
-            self.update_step_signal.emit(108)
+            self._emit_step(108)
             robot_has_wafer = False
             arm_with_wafer = None
-            parts = robot_presence_response.strip().rstrip('$').split(',')
-            if len(parts) == 5 and parts[2] == "OK":
-                if parts[3] == 'Presence' or parts[4] == 'Presence':
+            m = _PRESENCE_RE.match(robot_presence_response)
+            if m and m.group(3) is not None:
+                low_arm, up_arm = m.group(2, 3)
+                if low_arm == 'Presence' or up_arm == 'Presence':
                     robot_has_wafer = True
-                    arm_with_wafer = 'UpArm' if parts[4] == 'Presence' else 'LowArm' # 假設優先檢查上臂
-                    self.log_signal.emit(f"檢測到機械臂 {arm_with_wafer} 上有 Wafer", "orange")
+                    arm_with_wafer = 'UpArm' if up_arm == 'Presence' else 'LowArm' # 假設優先檢查上臂
+                    self._log(f"檢測到機械臂 {arm_with_wafer} 上有 Wafer", "orange")
 
             if robot_has_wafer:
                 if not self.empty_slots_lp1:
                     raise RuntimeError("機械臂上有 Wafer，但 Load Port 1 無空位可放")
                 # 步驟 109: 放至 Load Port1 空 Slot
-                target_slot = self.empty_slots_lp1.pop(0) # 取第一個空位
+                target_slot = self.empty_slots_lp1.popleft() # 取第一個空位
                 put_cmd = f"SmartPut,Robot1,{arm_with_wafer},Loadport1,{target_slot}"
                 _, status = self._send_cmd_and_wait(put_cmd, 109)
-                if status != "OK": raise RuntimeError(f"步驟 109 未收到 OK: {status}")
+                _require_ok(status, 109)
 
             # 步驟 111: 執行 Aligner 狀態確認
             aligner_presence_response, status = self._send_cmd_and_wait("CheckWaferPresence,Aligner1", 111)
-            if status != "OK": raise RuntimeError(f"步驟 111 未收到 OK: {status}")
+            _require_ok(status, 111)
 
             # 步驟 113: 檢查 Aligner 是否有 Wafer
-            self.update_step_signal.emit(113)
+            self._emit_step(113)
             aligner_has_wafer = False
-            parts = aligner_presence_response.strip().rstrip('$').split(',')
-            if len(parts) == 4 and parts[2] == "OK" and parts[3] == 'Presence':
+            m = _PRESENCE_RE.match(aligner_presence_response)
+            if m and m.group(3) is None and m.group(2) == 'Presence':
                  aligner_has_wafer = True
-                 self.log_signal.emit("檢測到 Aligner 上有 Wafer", "orange")
+                 self._log("檢測到 Aligner 上有 Wafer", "orange")
 
             if aligner_has_wafer:
                 # 步驟 114: 從 Aligner 取片 (假設用 UpArm)
                 get_cmd = "SmartGet,Robot1,UpArm,Aligner1,1"
                 _, status = self._send_cmd_and_wait(get_cmd, 114)
-                if status != "OK": raise RuntimeError(f"步驟 114 未收到 OK: {status}")
+                _require_ok(status, 114)
 
                 if not self.empty_slots_lp1:
                     raise RuntimeError("從 Aligner 取回 Wafer，但 Load Port 1 無空位可放")
                 # 步驟 116: 放至 Load Port1 空 Slot
-                target_slot = self.empty_slots_lp1.pop(0)
+                target_slot = self.empty_slots_lp1.popleft()
                 put_cmd = f"SmartPut,Robot1,UpArm,Loadport1,{target_slot}"
                 _, status = self._send_cmd_and_wait(put_cmd, 116)
-                if status != "OK": raise RuntimeError(f"步驟 116 未收到 OK: {status}")
+                _require_ok(status, 116)
 
             # B. 最終確認階段
             # 步驟 118: 重新檢查所有設備狀態 (簡化，實際應檢查更多)
-            self.update_step_signal.emit(118)
-            final_robot_presence, status_r = self._send_cmd_and_wait("CheckWaferPresence,Robot1", 118)
-            final_aligner_presence, status_a = self._send_cmd_and_wait("CheckWaferPresence,Aligner1", 118) # 重複步驟號以檢查
+            # 兩個查詢互不相依，一次送出後再依序收取回應
+            (final_robot_presence, status_r), (final_aligner_presence, status_a) = self._send_cmd_batch(
+                ["CheckWaferPresence,Robot1", "CheckWaferPresence,Aligner1"], 118)
             if status_r != "OK" or status_a != "OK":
-                 self.log_signal.emit("警告: 恢復後重新檢查狀態失敗", "orange")
+                 self._log("警告: 恢復後重新檢查狀態失敗", "orange")
                  recovery_successful = False # 狀態未知，視為失敗
             else:
                 # 步驟 120: 評估恢復結果
-                self.update_step_signal.emit(120)
-                recovery_successful = True # 初始假設成功
-                parts_r = final_robot_presence.strip().rstrip('$').split(',')
-                if len(parts_r) == 5 and parts_r[2] == "OK" and (parts_r[3] == 'Presence' or parts_r[4] == 'Presence'):
-                    recovery_successful = False
-                    self.log_signal.emit("恢復評估: 機械臂上仍有料片", "red")
-                parts_a = final_aligner_presence.strip().rstrip('$').split(',')
-                if len(parts_a) == 4 and parts_a[2] == "OK" and parts_a[3] == 'Presence':
-                    recovery_successful = False
-                    self.log_signal.emit("恢復評估: Aligner 上仍有料片", "red")
+                self._emit_step(120)
+                recovery_successful = self._evaluate_presence((
+                    ("機械臂", final_robot_presence, True),
+                    ("Aligner", final_aligner_presence, False),
+                ))
 
             if recovery_successful:
                 # 步驟 121: 亮綠燈
-                self.update_step_signal.emit(121)
+                self._emit_step(121)
                 self.send_efem_command_signal.emit("SignalTower,EFEM,Green,On")
-                time.sleep(0.5)
+                self._pause(0.5)
                 # 步驟 122: 執行 EFEM Home
                 _, status = self._send_cmd_and_wait("Home,EFEM", 122)
                 if status != "OK":
-                    self.log_signal.emit("警告: 恢復後執行 Home 指令失敗", "orange")
+                    self._log("警告: 恢復後執行 Home 指令失敗", "orange")
                     # 根據需求，Home 失敗也可能算恢復失敗
                     # recovery_successful = False
                     # raise RuntimeError("恢復後 Home 失敗")
-                final_status_code = 199 # 恢復完成
+                final_status_code = FlowStatus.RECOVERY_DONE # 恢復完成
             else:
                  # 步驟 124: 亮紅燈閃爍+警報
-                 self.update_step_signal.emit(124)
+                 self._emit_step(124)
                  self.send_efem_command_signal.emit("SignalTower,EFEM,Red,Flash")
                  # self.send_efem_command_signal.emit("SetBuzzer,EFEM,1,On") # 根據實際 API
                  raise RuntimeError("異常恢復失敗 (設備上仍有料片或狀態檢查失敗)")
 
         except StopIteration as e:
-            final_status_code = -102 # 使用者中止
-            self.log_signal.emit(f"(恢復)流程已中止: {e}", "orange")
+            final_status_code = FlowStatus.RECOVERY_STOP # 使用者中止
+            self._log(f"(恢復)流程已中止: {e}", "orange")
         except RuntimeError as e:
-            final_status_code = -101 # 錯誤中止
-            self.log_signal.emit(f"(恢復)流程錯誤中止: {e}", "red")
+            final_status_code = FlowStatus.RECOVERY_ERROR # 錯誤中止
+            self._log(f"(恢復)流程錯誤中止: {e}", "red")
             error_occurred = True
             # 觸發失敗狀態 (紅燈+警報)
             try:
-                self.update_step_signal.emit(124)
+                self._emit_step(124)
                 self.send_efem_command_signal.emit("SignalTower,EFEM,Red,Flash")
             except Exception as e_sig:
-                self.log_signal.emit(f"(恢復)設置失敗信號時出錯: {e_sig}", "red")
+                self._log(f"(恢復)設置失敗信號時出錯: {e_sig}", "red")
 
         except Exception as e:
-             final_status_code = -101 # 未預期錯誤
-             self.log_signal.emit(f"(恢復)流程發生未預期錯誤: {e}", "red")
+             final_status_code = FlowStatus.RECOVERY_ERROR # 未預期錯誤
+             self._log(f"(恢復)流程發生未預期錯誤: {e}", "red")
              error_occurred = True
              try:
-                 self.update_step_signal.emit(124)
+                 self._emit_step(124)
                  self.send_efem_command_signal.emit("SignalTower,EFEM,Red,Flash")
              except Exception as e_sig:
-                 self.log_signal.emit(f"(恢復)設置失敗信號時出錯: {e_sig}", "red")
+                 self._log(f"(恢復)設置失敗信號時出錯: {e_sig}", "red")
         finally:
             self.is_running = False
-            final_desc = get_step_description(final_status_code) # 使用全局函數
-            self.update_step_signal.emit(final_status_code) # 發送最終狀態碼
+            final_desc = final_status_code.desc
+            self._log(f"【恢復流程】結束 ({final_desc}).", "green" if not error_occurred else "red")
+            self._flush_log() # 結束訊息需排在流程結束信號之前
+            self._emit_step(final_status_code) # 發送最終狀態碼
             self.flow_finished_signal.emit(final_status_code) # 發送最終狀態碼
-            self.log_signal.emit(f"【恢復流程】結束 ({final_desc}).", "green" if not error_occurred else "red")
 
 
     def stop(self):
         """停止恢復流程執行"""
         if self.is_running:
-            self.log_signal.emit("正在中止恢復流程...", "orange")
+            self.log_signal.emit([("正在中止恢復流程...", "orange")]) # 由 GUI 執行緒呼叫，直接發送
             self.is_running = False
-            try: self.efem_response_queue.put_nowait("STOP_REQUESTED")
-            except queue.Full: pass
+            self._stop_evt.set()
+            self.set_efem_response("STOP_REQUESTED") # 喚醒正在等待的步驟
 
 
 # --- 主 GUI 視窗 (EFemApp) ---
@@ -800,9 +1104,20 @@ class EFemApp(QMainWindow):
         self.client_thread = None
         self.flow_thread = None
         self.recovery_thread = None # <--- 新增：恢復流程執行緒引用
+        self._response_sink = None # 執行中流程的 set_efem_response (見 _set_response_sink)
+        self._close_deadline = None # 關閉視窗時等待執行緒結束的期限
+        self._conn_state = ConnState.DISCONNECTED # 目前連線狀態 (不從標籤文字反推)
         self.step_list_widget = None
-        self.step_map = {}
+        self._step_row_index = {} # 流程類型 -> {步驟編號: 該列表的列號}
         self.current_highlighted_item = None
+        self._brush_highlight = QBrush(QColor('yellow')) # 高亮背景 (建立一次重複使用)
+        self._brush_default = QBrush() # 空筆刷: 還原為列表預設背景 (保留交替行顏色)
+        # 步驟高亮合併: 同一輪事件迴圈內連續收到的步驟只重繪最後一個
+        self._pending_step = None
+        self._step_timer = QTimer(self)
+        self._step_timer.setSingleShot(True)
+        self._step_timer.setInterval(0)
+        self._step_timer.timeout.connect(self._apply_pending_step)
         self.current_flow_type = 'normal' # 'normal' or 'recovery'
 
         # --- 左側面板 (控制) ---
@@ -841,9 +1156,51 @@ class EFemApp(QMainWindow):
 
         self.send_command_request_signal.connect(self.send_command_from_gui)
 
-        default_font = QFont("Microsoft JhengHei UI", 9)
-        self.setFont(default_font)
-        self.log_edit.setFont(QFont("Consolas", 9))
+        # 需要連線才能操作的控制項 (流程按鈕另由 set_flow_buttons_state 控制)
+        self._conn_dependent_widgets = [
+            self.get_efem_status_button, self.remote_button, self.local_button, self.home_efem_button,
+            self.module_tabs,
+            self.lp1_get_status_btn, self.lp1_load_btn, self.lp1_unload_btn, self.lp1_map_btn,
+            self.lp1_read_rfid_btn, self.lp1_reset_error_btn,
+            self.rbt1_get_status_btn, self.rbt1_home_btn, self.rbt1_stop_btn,
+            self.rbt1_smartget_btn, self.rbt1_smartput_btn,
+            self.al1_get_status_btn, self.al1_home_btn, self.al1_align_btn, self.al1_reset_error_btn,
+            self.ocr1_read_btn,
+        ]
+
+        # 各設備的顯示元件 (目前介面只有 1 號設備)：設備名稱 -> {欄位: (預先綁定的取值, setText)}
+        self.device_widgets = {
+            "Loadport1": {"status": (self.lp1_status_label.text, self.lp1_status_label.setText),
+                          "rfid": (self.lp1_rfid_label.text, self.lp1_rfid_label.setText),
+                          "map": (self.lp1_map_result_text.toPlainText, self.lp1_map_result_text.setText)},
+            "Robot1": {"status": (self.rbt1_status_label.text, self.rbt1_status_label.setText),
+                       "up": (self.rbt1_up_arm_label.text, self.rbt1_up_arm_label.setText),
+                       "low": (self.rbt1_low_arm_label.text, self.rbt1_low_arm_label.setText)},
+            "Aligner1": {"status": (self.al1_status_label.text, self.al1_status_label.setText),
+                         "wafer": (self.al1_wafer_label.text, self.al1_wafer_label.setText)},
+            "OCR1": {"result": (self.ocr1_result_label.text, self.ocr1_result_label.setText)},
+        }
+
+        # 事件/回應分派表 (建立一次)：設備類型 或 (指令, 設備類型) -> 處理函式
+        self._event_handlers = {
+            "EFEM": self._on_efem_event,
+            "Loadport": self._on_loadport_event,
+            "Robot": self._on_robot_event,
+            "Aligner": self._on_aligner_event,
+        }
+        self._status_handlers = {
+            ("GetStatus", "EFEM"): self._status_efem,
+            ("GetStatus", "Loadport"): self._status_loadport,
+            ("GetStatus", "Robot"): self._status_robot,
+            ("GetStatus", "Aligner"): self._status_aligner,
+            ("ReadFoupID", "Loadport"): self._status_rfid,
+            ("GetMapResult", "Loadport"): self._status_map,
+            ("ReadID", "OCR"): self._status_ocr,
+            ("GetCurrentMode", "EFEM"): self._status_mode,
+        }
+
+        self.setFont(_shared_font(*UI_FONT))
+        self.log_edit.setFont(_shared_font(*LOG_FONT))
 
         self.set_controls_enabled(False)
         self.populate_step_list('normal') # 初始顯示正常流程
@@ -864,13 +1221,15 @@ class EFemApp(QMainWindow):
         layout.addWidget(self.port_edit, 1, 1)
 
         self.connect_button = QPushButton("連線")
-        self.connect_button.setStyleSheet("background-color: lightgreen;")
+        self.connect_button.setStyleSheet(_CONN_BUTTON_QSS)
+        self._set_style_state(self.connect_button, "connect")
         self.connect_button.clicked.connect(self.toggle_connection)
         layout.addWidget(self.connect_button, 2, 0, 1, 2)
 
         layout.addWidget(QLabel("狀態:"), 3, 0)
         self.connection_status_label = QLabel("未連線")
-        self.connection_status_label.setStyleSheet("color: red; font-weight: bold;")
+        self.connection_status_label.setStyleSheet(_CONN_LABEL_QSS)
+        self._set_style_state(self.connection_status_label, "err")
         layout.addWidget(self.connection_status_label, 3, 1)
 
         self.connection_group.setLayout(layout)
@@ -901,19 +1260,23 @@ class EFemApp(QMainWindow):
 
         # 控制按鈕
         self.get_efem_status_button = QPushButton("取得狀態")
-        self.get_efem_status_button.clicked.connect(lambda: self.send_command_request_signal.emit("GetStatus,EFEM"))
+        self.get_efem_status_button.setProperty("efem_cmd", "GetStatus,EFEM")
+        self.get_efem_status_button.clicked.connect(self._on_cmd_button)
         layout.addWidget(self.get_efem_status_button, 2, 0)
 
         self.remote_button = QPushButton("遠端模式")
-        self.remote_button.clicked.connect(lambda: self.send_command_request_signal.emit("Remote,EFEM"))
+        self.remote_button.setProperty("efem_cmd", "Remote,EFEM")
+        self.remote_button.clicked.connect(self._on_cmd_button)
         layout.addWidget(self.remote_button, 2, 1)
 
         self.local_button = QPushButton("本地模式")
-        self.local_button.clicked.connect(lambda: self.send_command_request_signal.emit("Local,EFEM"))
+        self.local_button.setProperty("efem_cmd", "Local,EFEM")
+        self.local_button.clicked.connect(self._on_cmd_button)
         layout.addWidget(self.local_button, 2, 2)
 
         self.home_efem_button = QPushButton("EFEM 歸位")
-        self.home_efem_button.clicked.connect(lambda: self.send_command_request_signal.emit("Home,EFEM"))
+        self.home_efem_button.setProperty("efem_cmd", "Home,EFEM")
+        self.home_efem_button.clicked.connect(self._on_cmd_button)
         layout.addWidget(self.home_efem_button, 2, 3)
 
         self.efem_status_group.setLayout(layout)
@@ -933,23 +1296,28 @@ class EFemApp(QMainWindow):
         lp1_layout.addWidget(self.lp1_status_label, 0, 1, 1, 3) # Span 3
 
         self.lp1_get_status_btn = QPushButton("取得狀態")
-        self.lp1_get_status_btn.clicked.connect(lambda: self.send_command_request_signal.emit("GetStatus,Loadport1"))
+        self.lp1_get_status_btn.setProperty("efem_cmd", "GetStatus,Loadport1")
+        self.lp1_get_status_btn.clicked.connect(self._on_cmd_button)
         lp1_layout.addWidget(self.lp1_get_status_btn, 1, 0)
 
         self.lp1_load_btn = QPushButton("Load")
-        self.lp1_load_btn.clicked.connect(lambda: self.send_command_request_signal.emit("Load,Loadport1"))
+        self.lp1_load_btn.setProperty("efem_cmd", "Load,Loadport1")
+        self.lp1_load_btn.clicked.connect(self._on_cmd_button)
         lp1_layout.addWidget(self.lp1_load_btn, 1, 1)
 
         self.lp1_unload_btn = QPushButton("Unload")
-        self.lp1_unload_btn.clicked.connect(lambda: self.send_command_request_signal.emit("Unload,Loadport1"))
+        self.lp1_unload_btn.setProperty("efem_cmd", "Unload,Loadport1")
+        self.lp1_unload_btn.clicked.connect(self._on_cmd_button)
         lp1_layout.addWidget(self.lp1_unload_btn, 1, 2)
 
         self.lp1_map_btn = QPushButton("Map")
-        self.lp1_map_btn.clicked.connect(lambda: self.send_command_request_signal.emit("Map,Loadport1"))
+        self.lp1_map_btn.setProperty("efem_cmd", "Map,Loadport1")
+        self.lp1_map_btn.clicked.connect(self._on_cmd_button)
         lp1_layout.addWidget(self.lp1_map_btn, 1, 3)
 
         self.lp1_read_rfid_btn = QPushButton("讀取 RFID")
-        self.lp1_read_rfid_btn.clicked.connect(lambda: self.send_command_request_signal.emit("ReadFoupID,Loadport1"))
+        self.lp1_read_rfid_btn.setProperty("efem_cmd", "ReadFoupID,Loadport1")
+        self.lp1_read_rfid_btn.clicked.connect(self._on_cmd_button)
         lp1_layout.addWidget(self.lp1_read_rfid_btn, 2, 0)
 
         lp1_layout.addWidget(QLabel("RFID:"), 2, 1)
@@ -964,7 +1332,8 @@ class EFemApp(QMainWindow):
         lp1_layout.addWidget(self.lp1_map_result_text, 3, 1, 1, 3) # Span 3
 
         self.lp1_reset_error_btn = QPushButton("重設錯誤")
-        self.lp1_reset_error_btn.clicked.connect(lambda: self.send_command_request_signal.emit("ResetError,Loadport1"))
+        self.lp1_reset_error_btn.setProperty("efem_cmd", "ResetError,Loadport1")
+        self.lp1_reset_error_btn.clicked.connect(self._on_cmd_button)
         lp1_layout.addWidget(self.lp1_reset_error_btn, 4, 0)
 
         lp1_layout.setRowStretch(5, 1) # Push elements up
@@ -987,15 +1356,18 @@ class EFemApp(QMainWindow):
         rbt1_layout.addWidget(self.rbt1_low_arm_label, 0, 5)
 
         self.rbt1_get_status_btn = QPushButton("取得狀態")
-        self.rbt1_get_status_btn.clicked.connect(lambda: self.send_command_request_signal.emit("GetStatus,Robot1"))
+        self.rbt1_get_status_btn.setProperty("efem_cmd", "GetStatus,Robot1")
+        self.rbt1_get_status_btn.clicked.connect(self._on_cmd_button)
         rbt1_layout.addWidget(self.rbt1_get_status_btn, 1, 0, 1, 2)
 
         self.rbt1_home_btn = QPushButton("歸位")
-        self.rbt1_home_btn.clicked.connect(lambda: self.send_command_request_signal.emit("Home,Robot1"))
+        self.rbt1_home_btn.setProperty("efem_cmd", "Home,Robot1")
+        self.rbt1_home_btn.clicked.connect(self._on_cmd_button)
         rbt1_layout.addWidget(self.rbt1_home_btn, 1, 2, 1, 2)
 
         self.rbt1_stop_btn = QPushButton("停止")
-        self.rbt1_stop_btn.clicked.connect(lambda: self.send_command_request_signal.emit("Stop,Robot1"))
+        self.rbt1_stop_btn.setProperty("efem_cmd", "Stop,Robot1")
+        self.rbt1_stop_btn.clicked.connect(self._on_cmd_button)
         rbt1_layout.addWidget(self.rbt1_stop_btn, 1, 4, 1, 2)
 
         rbt1_layout.addWidget(QLabel("手臂:"), 2, 0)
@@ -1036,19 +1408,23 @@ class EFemApp(QMainWindow):
         al1_layout.addWidget(self.al1_wafer_label, 0, 3)
 
         self.al1_get_status_btn = QPushButton("取得狀態")
-        self.al1_get_status_btn.clicked.connect(lambda: self.send_command_request_signal.emit("GetStatus,Aligner1"))
+        self.al1_get_status_btn.setProperty("efem_cmd", "GetStatus,Aligner1")
+        self.al1_get_status_btn.clicked.connect(self._on_cmd_button)
         al1_layout.addWidget(self.al1_get_status_btn, 1, 0)
 
         self.al1_home_btn = QPushButton("歸位")
-        self.al1_home_btn.clicked.connect(lambda: self.send_command_request_signal.emit("Home,Aligner1"))
+        self.al1_home_btn.setProperty("efem_cmd", "Home,Aligner1")
+        self.al1_home_btn.clicked.connect(self._on_cmd_button)
         al1_layout.addWidget(self.al1_home_btn, 1, 1)
 
         self.al1_align_btn = QPushButton("對準")
-        self.al1_align_btn.clicked.connect(lambda: self.send_command_request_signal.emit("Alignment,Aligner1"))
+        self.al1_align_btn.setProperty("efem_cmd", "Alignment,Aligner1")
+        self.al1_align_btn.clicked.connect(self._on_cmd_button)
         al1_layout.addWidget(self.al1_align_btn, 1, 2)
 
         self.al1_reset_error_btn = QPushButton("重設錯誤")
-        self.al1_reset_error_btn.clicked.connect(lambda: self.send_command_request_signal.emit("ResetError,Aligner1"))
+        self.al1_reset_error_btn.setProperty("efem_cmd", "ResetError,Aligner1")
+        self.al1_reset_error_btn.clicked.connect(self._on_cmd_button)
         al1_layout.addWidget(self.al1_reset_error_btn, 1, 3)
 
         al1_layout.setRowStretch(2, 1) # Push elements up
@@ -1060,7 +1436,8 @@ class EFemApp(QMainWindow):
         ocr1_layout = QGridLayout(ocr1_tab)
         ocr1_layout.setSpacing(5) # 減少元件間距
         self.ocr1_read_btn = QPushButton("讀取 ID")
-        self.ocr1_read_btn.clicked.connect(lambda: self.send_command_request_signal.emit("ReadID,OCR1"))
+        self.ocr1_read_btn.setProperty("efem_cmd", "ReadID,OCR1")
+        self.ocr1_read_btn.clicked.connect(self._on_cmd_button)
         ocr1_layout.addWidget(self.ocr1_read_btn, 0, 0)
         ocr1_layout.addWidget(QLabel("結果:"), 0, 1)
         self.ocr1_result_label = QLineEdit("")
@@ -1102,15 +1479,16 @@ class EFemApp(QMainWindow):
         confirm_layout = QVBoxLayout()
         self.confirmation_info_label = QLabel("類型: -\n資料: -")
         self.confirmation_info_label.setWordWrap(True)
+        self.confirmation_info_label.setTextFormat(Qt.PlainText) # 內容為 EFEM 回傳資料，固定為純文字，不做 HTML 偵測/解析
         confirm_layout.addWidget(self.confirmation_info_label)
         confirm_btn_layout = QHBoxLayout()
         self.confirm_ok_button = QPushButton("資料正確")
         self.confirm_ok_button.setStyleSheet("background-color: lightgreen;")
-        self.confirm_ok_button.clicked.connect(lambda: self.confirm_data(True))
+        self.confirm_ok_button.clicked.connect(self._confirm_ok)
         confirm_btn_layout.addWidget(self.confirm_ok_button)
         self.confirm_err_button = QPushButton("資料錯誤")
         self.confirm_err_button.setStyleSheet("background-color: lightcoral;")
-        self.confirm_err_button.clicked.connect(lambda: self.confirm_data(False))
+        self.confirm_err_button.clicked.connect(self._confirm_err)
         confirm_btn_layout.addWidget(self.confirm_err_button)
         confirm_layout.addLayout(confirm_btn_layout)
         self.confirmation_group.setLayout(confirm_layout)
@@ -1123,9 +1501,26 @@ class EFemApp(QMainWindow):
         """建立日誌顯示區域"""
         self.log_group = QGroupBox("系統日誌")
         layout = QVBoxLayout()
-        self.log_edit = QTextEdit()
+        self.log_edit = QPlainTextEdit() # 純文字元件，附加日誌比 QTextEdit 輕量
         self.log_edit.setReadOnly(True)
+        self.log_edit.setMaximumBlockCount(LOG_MAX_LINES)
+        self.log_edit.setUndoRedoEnabled(False)
+        self._pending_log = [] # 尚未寫入日誌區域的 (文字, 顏色)
+        self._log_last_sec = -1 # 最近一次格式化時間戳的秒數
+        self._log_last_stamp = ""
+        self._log_flush_timer = QTimer(self)
+        self._log_flush_timer.setSingleShot(True)
+        self._log_flush_timer.setInterval(LOG_FLUSH_INTERVAL_MS)
+        self._log_flush_timer.timeout.connect(self._flush_log_view)
+        self._min_log_level = LOG_LEVEL_DEFAULT
+        self.log_debug_checkbox = QCheckBox("顯示除錯訊息")
+        self.log_debug_checkbox.toggled.connect(self._set_log_debug)
+        self.log_traffic_checkbox = QCheckBox("記錄收發內容")
+        self.log_traffic_checkbox.setChecked(True) # 預設記錄，與通訊執行緒的 log_verbose 一致
+        self.log_traffic_checkbox.toggled.connect(self._set_log_traffic)
         layout.addWidget(self.log_edit)
+        layout.addWidget(self.log_debug_checkbox)
+        layout.addWidget(self.log_traffic_checkbox)
         self.log_group.setLayout(layout)
 
 
@@ -1135,55 +1530,48 @@ class EFemApp(QMainWindow):
         layout = QVBoxLayout()
         layout.setContentsMargins(5, 5, 5, 5)
 
-        self.step_list_widget = QListWidget()
-        self.step_list_widget.setAlternatingRowColors(True) # 交替行顏色
-        self.step_list_widget.setStyleSheet("QListWidget::item { padding: 2px; }") # 調整行間距
-        self.step_list_widget.setFont(QFont("Microsoft JhengHei UI", 8)) # 列表使用稍小字體
-
-        # 初始不填充，由 populate_step_list 填充
-        self.step_list_widget.setMinimumHeight(150) # 給列表一個最小高度
-        layout.addWidget(self.step_list_widget)
+        # 正常/恢復兩個列表在此各填充一次，populate_step_list 只切換顯示哪一個
+        self._step_stack = QStackedWidget()
+        self._step_lists = {}
+        for flow_type, (steps_to_display, _) in _STEP_LIST_LAYOUT.items():
+            step_list = QListWidget()
+            step_list.setAlternatingRowColors(True) # 交替行顏色
+            step_list.setStyleSheet("QListWidget::item { padding: 2px; }") # 調整行間距
+            step_list.setFont(_shared_font(*LIST_FONT)) # 列表使用稍小字體
+            row_index = self._step_row_index[flow_type] = {}
+            for row, step_num in enumerate(steps_to_display):
+                list_item = QListWidgetItem(f"{step_num}. {_STEP_DESC_CACHE[step_num]}")
+                list_item.setData(Qt.UserRole, step_num)
+                step_list.addItem(list_item)
+                row_index[step_num] = row
+            self._step_stack.addWidget(step_list)
+            self._step_lists[flow_type] = step_list
+        self.step_list_widget = self._step_lists['normal']
+
+        self._step_stack.setMinimumHeight(150) # 給列表一個最小高度
+        layout.addWidget(self._step_stack)
         self.operation_status_group.setLayout(layout)
 
     def populate_step_list(self, flow_type='normal'):
-        """根據流程類型填充步驟列表"""
-        self.step_list_widget.clear()
-        self.step_map.clear()
-        self.current_highlighted_item = None
-        self.current_flow_type = flow_type
-
-        if flow_type == 'normal':
-            steps_to_display = range(1, 39)
-            descriptions = NORMAL_FLOW_STEPS
-            title = "作業項目流程 (正常)"
-        elif flow_type == 'recovery':
-            steps_to_display = range(101, 125) # 恢復流程步驟範圍
-            descriptions = RECOVERY_FLOW_STEPS
-            title = "作業項目流程 (恢復)"
-        else:
+        """根據流程類型切換顯示的步驟列表"""
+        if flow_type not in self._step_lists:
             return
-
-        self.operation_status_group.setTitle(title) # 更新 GroupBox 標題
-
-        for step_num in steps_to_display:
-             desc = get_step_description(step_num, slot='X') # 使用全局函數
-             item_text = f"{step_num}. {desc}"
-             list_item = QListWidgetItem(item_text)
-             list_item.setData(Qt.UserRole, step_num)
-             self.step_list_widget.addItem(list_item)
-             self.step_map[step_num] = list_item
-
-        # 添加結束狀態到映射 (用於結束時查找描述)
-        self.step_map[0] = QListWidgetItem(get_step_description(0))
-        self.step_map[99] = QListWidgetItem(get_step_description(99))
-        self.step_map[-1] = QListWidgetItem(get_step_description(-1))
-        self.step_map[-2] = QListWidgetItem(get_step_description(-2))
-        self.step_map[199] = QListWidgetItem(get_step_description(199))
-        self.step_map[-101] = QListWidgetItem(get_step_description(-101))
-        self.step_map[-102] = QListWidgetItem(get_step_description(-102))
+        if self.current_highlighted_item: # 清除舊列表的高亮，切回時不殘留
+            self.current_highlighted_item.setBackground(self._brush_default)
+            self.current_highlighted_item = None
+        self.current_flow_type = flow_type
+        self.step_list_widget = self._step_lists[flow_type]
+        self._step_stack.setCurrentWidget(self.step_list_widget)
+        self.operation_status_group.setTitle(_STEP_LIST_LAYOUT[flow_type][1]) # 更新 GroupBox 標題
+        # 結束狀態碼不在列表中，其描述直接由 _STEP_DESC_CACHE / get_step_description 取得
 
 
     # --- Slot Methods ---
+    @pyqtSlot()
+    def _on_cmd_button(self):
+        """共用的指令按鈕處理：送出按鈕 efem_cmd 屬性中的指令"""
+        self.send_command_request_signal.emit(self.sender().property("efem_cmd"))
+
     @pyqtSlot()
     def toggle_connection(self):
         """處理連線/中斷連線按鈕點擊"""
@@ -1193,9 +1581,9 @@ class EFemApp(QMainWindow):
             self.client_thread.stop()
             self.client_thread = None
             self.connect_button.setText("連線")
-            self.connect_button.setStyleSheet("background-color: lightgreen;")
+            self._set_style_state(self.connect_button, "connect")
             self.connection_status_label.setText("未連線")
-            self.connection_status_label.setStyleSheet("color: red; font-weight: bold;")
+            self._set_style_state(self.connection_status_label, "err")
             self.set_controls_enabled(False) # 禁用控制項
             self.clear_step_highlight() # 清除高亮
             self.populate_step_list('normal') # 切回正常流程列表
@@ -1212,25 +1600,27 @@ class EFemApp(QMainWindow):
                 self.connect_button.setText("連線中...")
                 self.connect_button.setEnabled(False)
                 self.connection_status_label.setText("連線中...")
-                self.connection_status_label.setStyleSheet("color: orange; font-weight: bold;")
+                self._set_style_state(self.connection_status_label, "busy")
 
                 self.client_thread = EFemClientThread(ip, port)
                 self.client_thread.connection_status_signal.connect(self.update_connection_status)
-                self.client_thread.received_data_signal.connect(self.handle_received_data)
-                self.client_thread.log_signal.connect(self.log_message)
+                self.client_thread.received_data_signal.connect(self.handle_received_batch)
+                self.client_thread.log_signal.connect(self.log_messages)
                 self.client_thread.finished.connect(self.on_client_thread_finished)
+                self.client_thread.response_sink = self._response_sink # 重新連線時沿用執行中流程的回應入口
+                self.client_thread.log_verbose = self.log_traffic_checkbox.isChecked()
                 self.client_thread.start()
 
             except ValueError:
                 QMessageBox.warning(self, "輸入錯誤", f"無效的埠號: {port_str}")
                 self.connection_status_label.setText("錯誤")
-                self.connection_status_label.setStyleSheet("color: red; font-weight: bold;")
+                self._set_style_state(self.connection_status_label, "err")
                 self.connect_button.setText("連線")
                 self.connect_button.setEnabled(True)
             except Exception as e:
                  QMessageBox.critical(self, "連線錯誤", f"建立連線時發生錯誤: {e}")
                  self.connection_status_label.setText("錯誤")
-                 self.connection_status_label.setStyleSheet("color: red; font-weight: bold;")
+                 self._set_style_state(self.connection_status_label, "err")
                  self.connect_button.setText("連線")
                  self.connect_button.setEnabled(True)
 
@@ -1263,10 +1653,11 @@ class EFemApp(QMainWindow):
         self.flow_thread.request_confirmation_signal.connect(self.handle_confirmation_request)
         self.flow_thread.send_efem_command_signal.connect(self.send_command_request_signal)
         self.flow_thread.flow_finished_signal.connect(self.handle_flow_finished)
-        self.flow_thread.log_signal.connect(self.log_message)
+        self.flow_thread.log_signal.connect(self.log_messages)
         # self.flow_thread.visual_update_signal 已移除
         self.flow_thread.finished.connect(self.on_flow_thread_finished)
 
+        self._set_response_sink(self.flow_thread.set_efem_response)
         self.flow_thread.start()
         self.set_flow_buttons_state(is_running=True)
 
@@ -1295,9 +1686,10 @@ class EFemApp(QMainWindow):
         self.recovery_thread.update_step_signal.connect(self.update_flow_step_display)
         self.recovery_thread.send_efem_command_signal.connect(self.send_command_request_signal)
         self.recovery_thread.flow_finished_signal.connect(self.handle_flow_finished) # 共用結束處理
-        self.recovery_thread.log_signal.connect(self.log_message)
+        self.recovery_thread.log_signal.connect(self.log_messages)
         self.recovery_thread.finished.connect(self.on_flow_thread_finished) # 共用結束處理
 
+        self._set_response_sink(self.recovery_thread.set_efem_response)
         self.recovery_thread.start()
         self.set_flow_buttons_state(is_running=True)
 
@@ -1333,19 +1725,20 @@ class EFemApp(QMainWindow):
     def update_connection_status(self, status):
         """更新 GUI 上的連線狀態顯示"""
         self.connection_status_label.setText(status)
-        if status == "Connected":
-            self.connection_status_label.setStyleSheet("color: green; font-weight: bold;")
+        state = self._conn_state = _CONN_STATE_BY_TEXT.get(status, ConnState.ERROR)
+        if state == ConnState.CONNECTED:
+            self._set_style_state(self.connection_status_label, "ok")
             self.connect_button.setText("中斷連線")
-            self.connect_button.setStyleSheet("background-color: lightcoral;")
+            self._set_style_state(self.connect_button, "disconnect")
             self.connect_button.setEnabled(True)
             self.set_controls_enabled(True)
             self.send_command_request_signal.emit("GetStatus,EFEM")
             self.clear_step_highlight()
 
-        elif status == "Disconnected":
-            self.connection_status_label.setStyleSheet("color: red; font-weight: bold;")
+        elif state == ConnState.DISCONNECTED:
+            self._set_style_state(self.connection_status_label, "err")
             self.connect_button.setText("連線")
-            self.connect_button.setStyleSheet("background-color: lightgreen;")
+            self._set_style_state(self.connect_button, "connect")
             self.connect_button.setEnabled(True)
             self.set_controls_enabled(False)
             self.clear_step_highlight()
@@ -1356,14 +1749,14 @@ class EFemApp(QMainWindow):
             self.efem_ffu_label.setText("未知")
             self.efem_door_label.setText("未知")
 
-        elif status == "Connecting":
-             self.connection_status_label.setStyleSheet("color: orange; font-weight: bold;")
+        elif state == ConnState.CONNECTING:
+             self._set_style_state(self.connection_status_label, "busy")
              self.connect_button.setEnabled(False)
              self.set_controls_enabled(False)
         else: # Error
-             self.connection_status_label.setStyleSheet("color: red; font-weight: bold;")
+             self._set_style_state(self.connection_status_label, "err")
              self.connect_button.setText("連線")
-             self.connect_button.setStyleSheet("background-color: lightgreen;")
+             self._set_style_state(self.connect_button, "connect")
              self.connect_button.setEnabled(True)
              self.set_controls_enabled(False)
              self.clear_step_highlight()
@@ -1371,21 +1764,30 @@ class EFemApp(QMainWindow):
     @pyqtSlot()
     def on_client_thread_finished(self):
         """通訊執行緒結束時的清理"""
+        thread = self.sender() # 先取得，之後的處理會再發送信號
         self.log_message("通訊執行緒已結束.", "gray")
-        if self.connection_status_label.text() == "Connected" or self.connection_status_label.text() == "Connecting":
-            self.update_connection_status("Disconnected")
-        self.client_thread = None
+        if thread is None or thread == self.client_thread: # 舊執行緒較晚結束時，不影響已重新連線的新執行緒
+            if self._conn_state in (ConnState.CONNECTED, ConnState.CONNECTING):
+                self.update_connection_status("Disconnected")
+            self.client_thread = None
+        if thread is not None:
+            thread.deleteLater() # 執行緒已結束，釋放 QThread 物件 (連線一併解除)
 
     @pyqtSlot()
     def on_flow_thread_finished(self):
         """流程執行緒結束時的清理 (適用於正常和恢復流程)"""
-        if self.sender() == self.flow_thread:
+        thread = self.sender() # 先取得，之後的處理會再發送信號
+        if self._response_sink == getattr(thread, "set_efem_response", None): # 不清掉新流程的入口
+            self._set_response_sink(None)
+        if thread == self.flow_thread:
              self.log_message("【正常流程】執行緒已結束.", "gray")
              self.flow_thread = None
-        elif self.sender() == self.recovery_thread:
+        elif thread == self.recovery_thread:
              self.log_message("【恢復流程】執行緒已結束.", "gray")
              self.recovery_thread = None
              self.populate_step_list('normal') # 恢復流程結束後，切回正常列表
+        if thread is not None:
+            thread.deleteLater() # 執行緒已結束，釋放 QThread 物件 (連線一併解除)
 
         # 只有當兩個流程都沒在跑時才更新按鈕
         if not (self.flow_thread and self.flow_thread.isRunning()) and \
@@ -1394,217 +1796,289 @@ class EFemApp(QMainWindow):
             self.confirmation_group.setVisible(False)
 
 
-    @pyqtSlot(str)
+    def _set_response_sink(self, sink):
+        """設定 (或以 None 清除) 通訊執行緒直接遞送 EFEM 回應的流程入口"""
+        self._response_sink = sink
+        if self.client_thread:
+            self.client_thread.response_sink = sink
+
+    @pyqtSlot(list)
+    def handle_received_batch(self, frames):
+        """依序處理通訊執行緒一次送來的多則訊息"""
+        handle = self.handle_received_data
+        for data in frames:
+            handle(data)
+
     def handle_received_data(self, data):
         """處理從通訊執行緒收到的原始資料"""
-        message = data.strip().rstrip('$')
+        if data.startswith("RAW_DATA:"): # 無法解碼的資料已由通訊執行緒記錄，直接略過
+            return
 
-        if message.startswith("Event,"):
-            self.handle_event(message)
-        elif ",OK" in message:
-            # 將回應傳遞給當前活動的流程執行緒
-            if self.flow_thread and self.flow_thread.isRunning():
-                 self.flow_thread.set_efem_response(message + "$")
-            elif self.recovery_thread and self.recovery_thread.isRunning():
-                 self.recovery_thread.set_efem_response(message + "$")
-            self.update_status_from_response(message + "$")
-        elif ",Error," in message:
-            self.handle_error(message + "$")
-            # 將錯誤回應也傳遞給當前活動的流程執行緒
-            if self.flow_thread and self.flow_thread.isRunning():
-                 self.flow_thread.set_efem_response(message + "$")
-            elif self.recovery_thread and self.recovery_thread.isRunning():
-                 self.recovery_thread.set_efem_response(message + "$")
-        elif message.startswith("RAW_DATA:"):
-             pass
-        else:
-             self.log_message(f"收到未識別訊息: {message}", "orange")
+        if data.startswith("Event,"):
+            self.handle_event(data.rstrip('$'))
+        elif ",OK" in data:
+            # 回應已由通訊執行緒直接交給執行中的流程 (response_sink)，此處只更新顯示；
+            # 通訊執行緒送來的訊息已去除空白並以 '$' 結尾，可直接傳入
+            self.update_status_from_response(data)
+        else: # 錯誤回應已由通訊執行緒格式化並記錄，不會送到這裡
+             self.log_message(f"收到未識別訊息: {data.strip().rstrip('$')}", "orange")
 
     @pyqtSlot(str, str)
     def log_message(self, message, color="black"):
         """將訊息附加到日誌區域"""
-        now = datetime.now().strftime("%H:%M:%S.%f")[:-3]
-        log_entry = f"[{now}] {message}"
-
-        self.log_edit.moveCursor(QTextCursor.End)
-        self.log_edit.setTextColor(QColor(color))
-        self.log_edit.insertPlainText(log_entry + "\n")
-        self.log_edit.setTextColor(QColor("black"))
-        self.log_edit.ensureCursorVisible()
+        if LOG_LEVEL.get(color, LOG_LEVEL_DEFAULT) < self._min_log_level: # 低於顯示等級的訊息直接捨棄
+            return
+        now = time.time()
+        sec = int(now)
+        if sec != self._log_last_sec: # HH:MM:SS 每秒只格式化一次，毫秒直接補上
+            self._log_last_sec = sec
+            self._log_last_stamp = time.strftime("%H:%M:%S", time.localtime(sec))
+        log_entry = f"[{self._log_last_stamp}.{int((now - sec) * 1000):03d}] {message}"
+
+        # 先暫存，由計時器每 LOG_FLUSH_INTERVAL_MS 一次寫入，避免每行都重新排版
+        self._pending_log.append((log_entry + "\n", color))
+        if not self._log_flush_timer.isActive():
+            self._log_flush_timer.start()
 
-    # handle_event, handle_error, update_status_from_response (與上一版本相同，省略)
+    @pyqtSlot()
+    def _flush_log_view(self):
+        """將暫存的日誌一次寫入日誌區域 (單一編輯區塊)"""
+        if not self._pending_log:
+            return
+        entries, self._pending_log = self._pending_log, []
+        # 只有原本就停在底部時才自動捲動，使用者往上翻閱時不打斷
+        sb = self.log_edit.verticalScrollBar()
+        at_bottom = sb.value() >= sb.maximum() - 4
+        cursor = QTextCursor(self.log_edit.document()) # 獨立游標，不移動檢視游標
+        cursor.movePosition(QTextCursor.End)
+        cursor.beginEditBlock()
+        # 連續同色的行合併為一次 insertText
+        run_color = entries[0][1]
+        run = []
+        for text, color in entries:
+            if color != run_color:
+                cursor.insertText("".join(run), _log_format(run_color))
+                run_color, run = color, []
+            run.append(text)
+        cursor.insertText("".join(run), _log_format(run_color))
+        cursor.endEditBlock()
+        if at_bottom:
+            sb.setValue(sb.maximum())
+
+    @pyqtSlot(bool)
+    def _set_log_debug(self, enabled):
+        """切換是否顯示 gray/darkgray 除錯訊息"""
+        self._min_log_level = LOG_LEVEL_DEBUG if enabled else LOG_LEVEL_DEFAULT
+
+    @pyqtSlot(bool)
+    def _set_log_traffic(self, enabled):
+        """切換通訊執行緒是否記錄每筆發送/收到的內容"""
+        if self.client_thread:
+            self.client_thread.log_verbose = enabled
+
+    @pyqtSlot(list)
+    def log_messages(self, entries):
+        """將流程執行緒整批送來的 (訊息, 顏色) 依序附加到日誌區域"""
+        for message, color in entries:
+            self.log_message(message, color)
+
+    # handle_event, update_status_from_response (與上一版本相同，省略)
     def handle_event(self, event_data):
         """解析事件並更新 GUI"""
         self.log_message(f"事件: {event_data}", "darkgreen")
-        parts = event_data.split(',')
-        event_type = parts[0] # "Event"
+        # 事件最多只讀到第 4 欄，限制切割次數；MapResult 只切出前 3 欄，其餘整段即為 Map 資料
+        parts = event_data.split(',', 3 if ",MapResult," in event_data else _EVENT_MAX_SPLIT)
         source = parts[1]     # "EFEM", "Loadport1", "Robot", etc.
 
-        # --- EFEM 事件 ---
-        if source == "EFEM":
-            if len(parts) >= 3:
-                event_name = parts[2]
-                if event_name == "Mode":
-                    mode = parts[3] if len(parts) > 3 else "未知"
-                    self.efem_mode_label.setText(f"{mode}")
-                elif event_name == "Power":
-                    pass
-                elif event_name == "Run":
-                    self.log_message("EFEM 開始執行...", "darkblue")
-                elif event_name == "Idle":
-                     self.log_message("EFEM 執行完畢/閒置", "darkblue")
-                elif event_name == "Error":
-                     self.log_message("EFEM 報告錯誤狀態", "red")
-
-        # --- Loadport 事件 ---
-        elif source.startswith("Loadport"):
-            lp_name = source # e.g., "Loadport1"
-            if len(parts) >= 3:
-                event_name = parts[2]
-                if event_name == "FoupPlace":
-                     self.log_message(f"{lp_name} Foup 放置", "darkmagenta")
-                     # self.simulation_widget.update_simulation('FoupPlaced', {'source': lp_name}) # 移除
-                     self.send_command_request_signal.emit(f"GetStatus,{lp_name}")
-                elif event_name == "FoupRemove":
-                     self.log_message(f"{lp_name} Foup 移除", "darkmagenta")
-                     # self.simulation_widget.update_simulation('FoupRemoved', {'source': lp_name}) # 移除
-                elif event_name == "PresenceSignal" or event_name == "PlacementSignal":
-                    signal_status = parts[3] if len(parts) > 3 else "?"
-                    self.log_message(f"{lp_name} {event_name}: {signal_status}", "gray")
-                elif event_name == "MapResult":
-                     map_data = ",".join(parts[3:]) if len(parts) > 3 else "無資料"
-                     self.log_message(f"{lp_name} Map 結果事件: {map_data[:30]}...", "darkcyan")
-                     if lp_name == "Loadport1":
-                         self.lp1_map_result_text.setText(map_data)
-                     # self.simulation_widget.update_simulation('MapResult', {'source': lp_name, 'map_data': map_data}) # 移除
-
-        # --- Robot 事件 ---
-        elif source.startswith("Robot"):
-             if len(parts) == 4:
-                 low_arm_status = parts[2]
-                 up_arm_status = parts[3]
-                 self.log_message(f"{source} 手臂狀態事件: 下={low_arm_status}, 上={up_arm_status}", "darkblue")
-                 if source == "Robot1":
-                     self.rbt1_low_arm_label.setText(low_arm_status)
-                     self.rbt1_up_arm_label.setText(up_arm_status)
-
-        # --- Aligner 事件 ---
-        elif source.startswith("Aligner"):
-             if len(parts) == 3:
-                 result = parts[2] # Presence/Absence
-                 self.log_message(f"{source} Wafer 狀態事件: {result}", "darkblue")
-                 if source == "Aligner1":
-                     self.al1_wafer_label.setText(result)
-
-        # --- 其他事件 ---
+        # 依來源設備類型 (去掉編號) 查表分派
+        handler = self._event_handlers.get(source.rstrip(_DEVICE_INDEX_DIGITS))
+        if handler:
+            handler(source, parts)
         else:
             self.log_message(f"收到未處理事件來源: {event_data}", "orange")
 
-
-    def handle_error(self, error_data):
-        """解析錯誤回應並顯示"""
-        parts = error_data.strip().rstrip('$').split(',')
-        if len(parts) >= 4 and parts[-2] == "Error":
-            error_code = parts[-1].strip()
-            command_sent = parts[0]
-            device = parts[1]
-            error_desc = ERROR_CODES.get(error_code, f"未知錯誤碼 ({error_code})")
-            full_error_msg = f"指令錯誤: [{device}] {command_sent} -> {error_desc}"
-            self.log_message(full_error_msg, "red")
-        else:
-            self.log_message(f"收到未解析錯誤回應: {error_data.strip()}", "red")
+    def _set_device_field(self, device, field, text):
+        """更新設備欄位的顯示元件；沒有對應介面的設備/欄位或內容未變則略過"""
+        fields = self.device_widgets.get(device)
+        if fields:
+            widget = fields.get(field)
+            if widget:
+                getter, setter = widget
+                if getter() != text: # 輪詢結果常與上次相同，未變就不觸發重繪
+                    setter(text)
+
+    @staticmethod
+    def _set_style_state(widget, state):
+        """切換元件的樣式狀態 (動態屬性)，只重新套用樣式而不重新解析樣式表"""
+        if widget.property("state") != state:
+            widget.setProperty("state", state)
+            style = widget.style()
+            style.unpolish(widget)
+            style.polish(widget)
+
+    @staticmethod
+    def _set_label(label, text):
+        """內容有變才呼叫 setText"""
+        if label.text() != text:
+            label.setText(text)
+
+    # --- 事件處理 (由 handle_event 分派) ---
+    def _on_efem_event(self, source, parts):
+        """EFEM 事件"""
+        if len(parts) >= 3:
+            event_name = parts[2]
+            if event_name == "Mode":
+                mode = parts[3] if len(parts) > 3 else "未知"
+                self._set_label(self.efem_mode_label, mode)
+            elif event_name in _EFEM_EVENT_LOGS: # Run / Idle / Error 僅記錄日誌；Power 不處理
+                self.log_message(*_EFEM_EVENT_LOGS[event_name])
+
+    def _on_loadport_event(self, lp_name, parts):
+        """Loadport 事件"""
+        if len(parts) >= 3:
+            event_name = parts[2]
+            if event_name == "FoupPlace":
+                 self.log_message(f"{lp_name} Foup 放置", "darkmagenta")
+                 self.send_command_request_signal.emit(f"GetStatus,{lp_name}")
+            elif event_name == "FoupRemove":
+                 self.log_message(f"{lp_name} Foup 移除", "darkmagenta")
+            elif event_name == "PresenceSignal" or event_name == "PlacementSignal":
+                signal_status = parts[3] if len(parts) > 3 else "?"
+                self.log_message(f"{lp_name} {event_name}: {signal_status}", "gray")
+            elif event_name == "MapResult":
+                 map_data = parts[3] if len(parts) > 3 else "無資料"
+                 self.log_message(f"{lp_name} Map 結果事件: {map_data[:30]}...", "darkcyan")
+                 self._set_device_field(lp_name, "map", map_data)
+
+    def _on_robot_event(self, source, parts):
+        """Robot 手臂狀態事件"""
+        if len(parts) == 4:
+            low_arm_status = parts[2]
+            up_arm_status = parts[3]
+            self.log_message(f"{source} 手臂狀態事件: 下={low_arm_status}, 上={up_arm_status}", "darkblue")
+            self._set_device_field(source, "low", low_arm_status)
+            self._set_device_field(source, "up", up_arm_status)
+
+    def _on_aligner_event(self, source, parts):
+        """Aligner Wafer 狀態事件"""
+        if len(parts) == 3:
+            result = parts[2] # Presence/Absence
+            self.log_message(f"{source} Wafer 狀態事件: {result}", "darkblue")
+            self._set_device_field(source, "wafer", result)
 
     def update_status_from_response(self, response_data):
         """根據成功的指令回應更新 GUI 狀態"""
-        parts = response_data.strip().rstrip('$').split(',')
+        text = response_data.strip().rstrip('$')
+        # 回應最多只讀到第 13 欄，限制切割次數；GetMapResult 只切出前 3 欄，其餘整段即為 Map 資料
+        parts = text.split(',', 3 if text.startswith("GetMapResult,") else _STATUS_MAX_SPLIT)
         command = parts[0]
         device = parts[1]
 
-        if command == "GetStatus":
-            if device == "EFEM" and len(parts) >= 13 and parts[2] == "OK":
-                emo_status = "觸發" if parts[3] == '0' else "正常"
-                ffu_pd_status = "過高" if parts[4] == '0' else "正常"
-                mode = "本地 (Local)" if parts[10] == '0' else "遠端 (Remote)"
-                robot_en = "禁用" if parts[11] == '0' else "啟用"
-                door = "開啟" if parts[12] == '0' else "關閉"
-                self.efem_emo_label.setText(emo_status)
-                self.efem_ffu_label.setText(f"FFU PD:{ffu_pd_status}")
-                self.efem_mode_label.setText(mode)
-                self.efem_door_label.setText(door)
-                self.log_message(f"EFEM 狀態更新: EMO={emo_status}, Mode={mode}, Door={door}", "darkgray")
-
-            elif device.startswith("Loadport") and len(parts) >= 8 and parts[2] == "OK":
-                lp_name = device
-                mode, error, foup, clamp, door = parts[3:8]
-                status_text = f"模式:{mode}, 錯誤:{error}, Foup:{foup}, Clamp:{clamp}, Door:{door}"
-                if lp_name == "Loadport1":
-                    self.lp1_status_label.setText(status_text)
-                self.log_message(f"{lp_name} 狀態更新: {status_text}", "darkgray")
-
-            elif device.startswith("Robot") and len(parts) >= 6 and parts[2] == "OK":
-                 rbt_name = device
-                 status_code = parts[3]
-                 up_presence = parts[4]
-                 low_presence = parts[5]
-                 if rbt_name == "Robot1":
-                     self.rbt1_status_label.setText(f"代碼:{status_code}")
-                     self.rbt1_up_arm_label.setText(up_presence)
-                     self.rbt1_low_arm_label.setText(low_presence)
-                 self.log_message(f"{rbt_name} 狀態更新: Code={status_code}, Up={up_presence}, Low={low_presence}", "darkgray")
-
-            elif device.startswith("Aligner") and len(parts) >= 6 and parts[2] == "OK":
-                 al_name = device
-                 mode = parts[3]
-                 wafer = parts[4]
-                 vac_cda = parts[5]
-                 if al_name == "Aligner1":
-                     self.al1_status_label.setText(mode)
-                     self.al1_wafer_label.setText(wafer)
-                 self.log_message(f"{al_name} 狀態更新: Mode={mode}, Wafer={wafer}, Vac/CDA={vac_cda}", "darkgray")
-
-        elif command == "ReadFoupID" and device.startswith("Loadport") and len(parts) == 4 and parts[2] == "OK":
-            lp_name = device
+        # 依 (指令, 設備類型) 查表分派；各處理函式自行檢查欄位數與 OK
+        handler = self._status_handlers.get((command, device.rstrip(_DEVICE_INDEX_DIGITS)))
+        if handler:
+            handler(device, parts)
+
+    # --- 指令回應處理 (由 update_status_from_response 分派) ---
+    def _status_efem(self, device, parts):
+        """GetStatus,EFEM"""
+        if len(parts) >= 13 and parts[2] == "OK":
+            emo, ffu, md, dr = parts[3], parts[4], parts[10], parts[12] # 第 11 欄 (Robot 啟用) 介面未顯示
+            emo_status = _EFEM_EMO_TEXT[emo != '0']
+            mode = _EFEM_MODE_TEXT[md != '0']
+            door = _EFEM_DOOR_TEXT[dr != '0']
+            self._set_label(self.efem_emo_label, emo_status)
+            self._set_label(self.efem_ffu_label, _EFEM_FFU_TEXT[ffu != '0'])
+            self._set_label(self.efem_mode_label, mode)
+            self._set_label(self.efem_door_label, door)
+            self.log_message(f"EFEM 狀態更新: EMO={emo_status}, Mode={mode}, Door={door}", "darkgray")
+
+    def _status_loadport(self, lp_name, parts):
+        """GetStatus,LoadportN"""
+        if len(parts) >= 8 and parts[2] == "OK":
+            mode, error, foup, clamp, door = parts[3:8]
+            status_text = f"模式:{mode}, 錯誤:{error}, Foup:{foup}, Clamp:{clamp}, Door:{door}"
+            self._set_device_field(lp_name, "status", status_text)
+            self.log_message(f"{lp_name} 狀態更新: {status_text}", "darkgray")
+
+    def _status_robot(self, rbt_name, parts):
+        """GetStatus,RobotN"""
+        if len(parts) >= 6 and parts[2] == "OK":
+             status_code = parts[3]
+             up_presence = parts[4]
+             low_presence = parts[5]
+             self._set_device_field(rbt_name, "status", f"代碼:{status_code}")
+             self._set_device_field(rbt_name, "up", up_presence)
+             self._set_device_field(rbt_name, "low", low_presence)
+             self.log_message(f"{rbt_name} 狀態更新: Code={status_code}, Up={up_presence}, Low={low_presence}", "darkgray")
+
+    def _status_aligner(self, al_name, parts):
+        """GetStatus,AlignerN"""
+        if len(parts) >= 6 and parts[2] == "OK":
+             mode = parts[3]
+             wafer = parts[4]
+             vac_cda = parts[5]
+             self._set_device_field(al_name, "status", mode)
+             self._set_device_field(al_name, "wafer", wafer)
+             self.log_message(f"{al_name} 狀態更新: Mode={mode}, Wafer={wafer}, Vac/CDA={vac_cda}", "darkgray")
+
+    def _status_rfid(self, lp_name, parts):
+        """ReadFoupID,LoadportN"""
+        if len(parts) == 4 and parts[2] == "OK":
             rfid = parts[3]
-            if lp_name == "Loadport1":
-                self.lp1_rfid_label.setText(rfid)
+            self._set_device_field(lp_name, "rfid", rfid)
             self.log_message(f"{lp_name} RFID 讀取成功: {rfid}", "darkcyan")
 
-        elif command == "GetMapResult" and device.startswith("Loadport") and len(parts) >= 4 and parts[2] == "OK":
-            lp_name = device
-            map_data = ",".join(parts[3:])
-            if lp_name == "Loadport1":
-                self.lp1_map_result_text.setText(map_data)
+    def _status_map(self, lp_name, parts):
+        """GetMapResult,LoadportN"""
+        if len(parts) >= 4 and parts[2] == "OK":
+            map_data = parts[3]
+            self._set_device_field(lp_name, "map", map_data)
             self.log_message(f"{lp_name} Map 結果讀取成功: {map_data[:30]}...", "darkcyan")
-            # self.simulation_widget.update_simulation('MapResult', {'source': lp_name, 'map_data': map_data}) # 移除
 
-        elif command == "ReadID" and device.startswith("OCR") and len(parts) == 4 and parts[2] == "OK":
-            ocr_name = device
+    def _status_ocr(self, ocr_name, parts):
+        """ReadID,OCRN"""
+        if len(parts) == 4 and parts[2] == "OK":
             ocr_result = parts[3]
-            if ocr_name == "OCR1":
-                 self.ocr1_result_label.setText(ocr_result)
+            self._set_device_field(ocr_name, "result", ocr_result)
             self.log_message(f"{ocr_name} OCR 讀取成功: {ocr_result}", "darkcyan")
 
-        elif command == "GetCurrentMode" and device == "EFEM" and len(parts) == 4 and parts[2] == "OK":
+    def _status_mode(self, device, parts):
+        """GetCurrentMode,EFEM"""
+        if len(parts) == 4 and parts[2] == "OK":
             mode = parts[3]
-            self.efem_mode_label.setText(mode)
+            self._set_label(self.efem_mode_label, mode)
             self.log_message(f"EFEM 目前模式: {mode}", "darkgray")
 
 
     @pyqtSlot(int) # 接收 int (步驟編號)
     def update_flow_step_display(self, step_num):
-        """更新流程步驟列表的高亮"""
+        """記錄目前步驟，並排程更新流程步驟列表的高亮"""
+        self._pending_step = step_num
+        if not self._step_timer.isActive():
+            self._step_timer.start()
+
+        # 更新日誌 (每個步驟都記錄)
+        # 此處沒有 slot 參數，使用快取描述 (參數以 X 代替)，不顯示未格式化的 %(slot)s
+        step_desc = _STEP_DESC_CACHE.get(step_num) or get_step_description(step_num)
+        self.log_message(f"目前作業: ({step_num}) {step_desc}", "darkMagenta")
+
+    @pyqtSlot()
+    def _apply_pending_step(self):
+        """套用最新一個步驟的高亮"""
+        step_num = self._pending_step
         # 清除先前的高亮
-        default_bg_color = self.step_list_widget.palette().base().color()
         if self.current_highlighted_item:
-            self.current_highlighted_item.setBackground(default_bg_color)
+            self.current_highlighted_item.setBackground(self._brush_default)
             self.current_highlighted_item = None
 
-        # 找到新步驟對應的列表項目
-        item_to_highlight = self.step_map.get(step_num)
+        # 找到新步驟在目前顯示列表中的項目 (另一流程的步驟不會對到此列表的列)
+        row = self._step_row_index[self.current_flow_type].get(step_num)
+        item_to_highlight = self.step_list_widget.item(row) if row is not None else None
 
         if item_to_highlight and step_num > 0: # 僅高亮有效步驟編號
             # --- 使用更明顯的顏色 ---
-            item_to_highlight.setBackground(QColor('yellow')) # 設定高亮背景色為黃色
+            item_to_highlight.setBackground(self._brush_highlight) # 設定高亮背景色為黃色
             self.current_highlighted_item = item_to_highlight
             # 確保高亮項目可見
             self.step_list_widget.scrollToItem(item_to_highlight, QListWidget.ScrollHint.EnsureVisible)
@@ -1613,10 +2087,6 @@ class EFemApp(QMainWindow):
         else:
             self.log_message(f"警告: 在列表中找不到步驟 {step_num} 以高亮顯示", "orange")
 
-        # 更新日誌
-        step_desc = get_step_description(step_num) # 使用全局函數
-        self.log_message(f"目前作業: ({step_num}) {step_desc}", "darkMagenta")
-
 
     @pyqtSlot(str, str)
     def handle_confirmation_request(self, confirmation_type, data_to_confirm):
@@ -1625,6 +2095,16 @@ class EFemApp(QMainWindow):
         self.confirmation_group.setVisible(True)
         self.log_message(f"流程暫停: 等待使用者確認 {confirmation_type}", "darkorange")
 
+    @pyqtSlot()
+    def _confirm_ok(self):
+        """「資料正確」按鈕"""
+        self.confirm_data(True)
+
+    @pyqtSlot()
+    def _confirm_err(self):
+        """「資料錯誤」按鈕"""
+        self.confirm_data(False)
+
     def confirm_data(self, confirmed_ok):
         """處理使用者點擊確認按鈕"""
         # 將確認結果發送給當前活動的流程執行緒
@@ -1646,7 +2126,7 @@ class EFemApp(QMainWindow):
     def handle_flow_finished(self, final_status_code):
         """處理流程結束事件 (通用)"""
         status_description = get_step_description(final_status_code) # 使用全局函數
-        log_color = "green" if final_status_code in [99, 199] else "red"
+        log_color = "green" if final_status_code in (FlowStatus.DONE, FlowStatus.RECOVERY_DONE) else "red"
 
         self.log_message(f"流程結束: {status_description}", log_color)
         self.clear_step_highlight()
@@ -1665,55 +2145,34 @@ class EFemApp(QMainWindow):
 
     def clear_step_highlight(self):
         """清除步驟列表中的高亮"""
+        # 高亮只經由 _apply_pending_step 設定並記錄在 current_highlighted_item，
+        # 切換列表時 populate_step_list 也會先清除，因此只需處理這一項
         if self.current_highlighted_item:
-            default_bg_color = self.step_list_widget.palette().base().color()
-            self.current_highlighted_item.setBackground(default_bg_color)
+            self.current_highlighted_item.setBackground(self._brush_default)
             self.current_highlighted_item = None
-        else: # 如果沒有追蹤的項目，遍歷清除
-            default_bg_color = self.step_list_widget.palette().base().color()
-            for i in range(self.step_list_widget.count()):
-                item = self.step_list_widget.item(i)
-                if item: # 確保項目存在
-                    item.setBackground(default_bg_color)
 
 
     # set_controls_enabled, send_robot_smart_get, send_robot_smart_put (與上一版本相同，省略)
     def set_controls_enabled(self, enabled):
         """啟用或禁用需要連線才能操作的控制項"""
-        self.get_efem_status_button.setEnabled(enabled)
-        self.remote_button.setEnabled(enabled)
-        self.local_button.setEnabled(enabled)
-        self.home_efem_button.setEnabled(enabled)
-        # 流程按鈕的狀態由 set_flow_buttons_state 控制
-        if not enabled: # 如果是禁用所有控件
-            self.start_flow_button.setEnabled(False)
-            self.start_recovery_button.setEnabled(False)
-            self.stop_flow_button.setEnabled(False)
-        else: # 如果是啟用，則根據是否有流程在跑來決定
-             is_running = (self.flow_thread and self.flow_thread.isRunning()) or \
-                          (self.recovery_thread and self.recovery_thread.isRunning())
-             self.set_flow_buttons_state(is_running)
-
-        self.module_tabs.setEnabled(enabled)
-        # Tab 內按鈕
-        self.lp1_get_status_btn.setEnabled(enabled)
-        self.lp1_load_btn.setEnabled(enabled)
-        self.lp1_unload_btn.setEnabled(enabled)
-        self.lp1_map_btn.setEnabled(enabled)
-        self.lp1_read_rfid_btn.setEnabled(enabled)
-        self.lp1_reset_error_btn.setEnabled(enabled)
-        self.rbt1_get_status_btn.setEnabled(enabled)
-        self.rbt1_home_btn.setEnabled(enabled)
-        self.rbt1_stop_btn.setEnabled(enabled)
-        self.rbt1_smartget_btn.setEnabled(enabled)
-        self.rbt1_smartput_btn.setEnabled(enabled)
-        self.al1_get_status_btn.setEnabled(enabled)
-        self.al1_home_btn.setEnabled(enabled)
-        self.al1_align_btn.setEnabled(enabled)
-        self.al1_reset_error_btn.setEnabled(enabled)
-        self.ocr1_read_btn.setEnabled(enabled)
+        self.setUpdatesEnabled(False) # 整批切換後只重繪一次
+        try:
+            for widget in self._conn_dependent_widgets:
+                widget.setEnabled(enabled)
+            # 流程按鈕的狀態由 set_flow_buttons_state 控制
+            if not enabled: # 如果是禁用所有控件
+                self.start_flow_button.setEnabled(False)
+                self.start_recovery_button.setEnabled(False)
+                self.stop_flow_button.setEnabled(False)
+            else: # 如果是啟用，則根據是否有流程在跑來決定
+                is_running = (self.flow_thread and self.flow_thread.isRunning()) or \
+                             (self.recovery_thread and self.recovery_thread.isRunning())
+                self.set_flow_buttons_state(is_running)
+        finally:
+            self.setUpdatesEnabled(True)
 
 
+    @pyqtSlot()
     def send_robot_smart_get(self):
         """發送 SmartGet 指令"""
         arm = self.rbt1_arm_combo.currentText()
@@ -1725,6 +2184,7 @@ class EFemApp(QMainWindow):
         command = f"SmartGet,Robot1,{arm},{dest},{slot}"
         self.send_command_request_signal.emit(command)
 
+    @pyqtSlot()
     def send_robot_smart_put(self):
         """發送 SmartPut 指令"""
         arm = self.rbt1_arm_combo.currentText()
@@ -1738,20 +2198,29 @@ class EFemApp(QMainWindow):
 
 
     def closeEvent(self, event):
-        """關閉視窗前的清理"""
-        self.log_message("關閉應用程式...", "gray")
-        if self.flow_thread and self.flow_thread.isRunning():
-            self.flow_thread.stop()
-            self.flow_thread.wait(500)
-        if self.recovery_thread and self.recovery_thread.isRunning(): # <--- 關閉恢復執行緒
-            self.recovery_thread.stop()
-            self.recovery_thread.wait(500)
-        if self.client_thread and self.client_thread.is_running:
-            self.client_thread.stop()
-            self.client_thread.wait(500)
+        """關閉視窗前的清理：先通知所有執行緒停止，再以計時器輪詢，不在 GUI 執行緒上 wait()"""
+        if self._close_deadline is None:
+            self.log_message("關閉應用程式...", "gray")
+            if self.flow_thread and self.flow_thread.isRunning():
+                self.flow_thread.stop()
+            if self.recovery_thread and self.recovery_thread.isRunning(): # <--- 關閉恢復執行緒
+                self.recovery_thread.stop()
+            if self.client_thread and self.client_thread.is_running:
+                self.client_thread.stop()
+            self._close_deadline = time.monotonic() + CLOSE_WAIT_TIMEOUT
+        if self._threads_running() and time.monotonic() < self._close_deadline:
+            event.ignore()
+            QTimer.singleShot(CLOSE_POLL_INTERVAL_MS, self.close) # 稍後再試一次關閉
+            return
 
+        self._flush_log_view()
         event.accept()
 
+    def _threads_running(self):
+        """是否仍有執行緒尚未結束"""
+        return any(t is not None and t.isRunning()
+                   for t in (self.flow_thread, self.recovery_thread, self.client_thread))
+
     # sync_toggle_button_state 方法已被移除
 
 